@@ -0,0 +1,205 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from vista_rpc_cache import DEFAULT_TTLS
+
+
+class _DFNPlaceholder:
+    def __repr__(self):
+        return "DFN"
+
+
+# Stands for the selected patient's DFN in a prefetch parameter template.
+DFN = _DFNPlaceholder()
+
+# What a clinician usually opens right after selecting a patient: allergies,
+# problems, recent notes and vitals. RPC name -> parameter template.
+DEFAULT_PREFETCH_RPCS = {
+    "ORQQAL LIST": (DFN,),
+    "ORQQPL PROBLEM LIST": (DFN, "A"),
+    "TIU DOCUMENTS BY CONTEXT": ("3", "1", DFN, "", ""),
+    "ORQQVI VITALS": (DFN,),
+}
+
+
+class ChartPrefetcher:
+    """
+    Speculatively fetches a patient's chart as soon as the patient is selected.
+
+    patient_selected() starts the prefetch RPCs in the background; get() then
+    hands out their replies, waiting for one still in flight, so the chart
+    opens from local results instead of a round trip per panel.
+
+    Which RPCs are prefetched is learned: get() counts every RPC the user asks
+    for while a patient is selected, and records a parameter template for it
+    when its parameters include the patient's DFN. The max_rpcs most used RPCs
+    with a known template are prefetched, the configured ones breaking ties.
+    Counts and learned templates can be kept in a JSON file between runs.
+
+    Only RPCs on the read_only allowlist are ever prefetched, learned or
+    loaded from the usage file, since a prefetch repeats the call for every
+    patient selected. A call to any other RPC may change the chart, so it
+    drops the replies prefetched so far.
+    """
+
+    def __init__(self, call, rpcs=None, max_rpcs=4, ttl=120, workers=2, usage_path=None, read_only=None):
+        """
+        Initializes the ChartPrefetcher.
+
+        Args:
+            call (callable): call(rpc_name, params) makes an RPC call with a list of
+                             literal parameters and returns the reply. It is called
+                             from worker threads, so it must be thread-safe.
+            rpcs (dict, optional): RPC name -> parameter template, with DFN marking the
+                                   patient's DFN. Defaults to DEFAULT_PREFETCH_RPCS.
+            max_rpcs (int): The number of RPCs prefetched per patient.
+            ttl (float): Seconds a prefetched reply may be handed out.
+            workers (int): The number of prefetches run at once.
+            usage_path (str, optional): A JSON file usage counts are loaded from and saved to.
+            read_only (iterable, optional): The RPCs that only read and so may be prefetched.
+                                            Defaults to the cacheable RPCs of vista_rpc_cache.
+        """
+        self.call = call
+        self.read_only = frozenset(DEFAULT_TTLS if read_only is None else read_only)
+        self.templates = {}
+        for rpc_name, template in (DEFAULT_PREFETCH_RPCS if rpcs is None else rpcs).items():
+            if rpc_name in self.read_only:
+                self.templates[rpc_name] = template
+            else:
+                logging.warning(f"Not prefetching '{rpc_name}': it is not a read-only RPC.")
+        self.max_rpcs = max_rpcs
+        self.ttl = ttl
+        self.usage_path = usage_path
+        self.usage = {}
+        self.hits = 0
+        self.misses = 0
+        self._configured = list(self.templates)
+        self._dfn = None
+        self._entries = {}   # (rpc_name, params) -> (future, started_at) for the selected patient
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        if usage_path:
+            self.load_usage()
+
+    def prefetch_rpcs(self):
+        """Returns the RPCs prefetched for the next patient, most used first."""
+        order = {rpc_name: index for index, rpc_name in enumerate(self._configured)}
+        ranked = sorted(self.templates, key=lambda rpc_name: (-self.usage.get(rpc_name, 0),
+                                                              order.get(rpc_name, len(order))))
+        return ranked[:self.max_rpcs]
+
+    def patient_selected(self, dfn):
+        """
+        Starts prefetching a newly selected patient's chart.
+
+        Replies prefetched for the previous patient are dropped, and prefetches
+        for that patient that have not started yet are cancelled.
+        """
+        dfn = str(dfn)
+        with self._lock:
+            for future, _ in self._entries.values():
+                future.cancel()
+            self._entries = {}
+            self._dfn = dfn
+            for rpc_name in self.prefetch_rpcs():
+                params = tuple(dfn if value is DFN else value for value in self.templates[rpc_name])
+                future = self._executor.submit(self._fetch, dfn, rpc_name, params)
+                self._entries[(rpc_name, params)] = (future, time.monotonic())
+
+    def get(self, rpc_name, params, dfn=None):
+        """
+        Returns the prefetched reply to a call, and counts the call as a use of rpc_name.
+
+        Args:
+            rpc_name (str): The name of the RPC.
+            params (list): The call's literal parameter values.
+            dfn (str, optional): The patient the call is for. Defaults to the selected patient.
+
+        Returns:
+            The reply, or None if the call was not prefetched, is stale or failed;
+            the caller should then make the call itself.
+        """
+        params = tuple(str(value) for value in params)
+        with self._lock:
+            if rpc_name not in self.read_only:
+                # The call may change what the prefetched replies say.
+                for future, _ in self._entries.values():
+                    future.cancel()
+                self._entries = {}
+                return None
+            selected = self._dfn
+            self.usage[rpc_name] = self.usage.get(rpc_name, 0) + 1
+            if selected is not None and selected in params and rpc_name not in self.templates:
+                self.templates[rpc_name] = tuple(DFN if value == selected else value for value in params)
+            entry = self._entries.get((rpc_name, params))
+            if entry is None or (dfn is not None and str(dfn) != selected) or \
+                    time.monotonic() - entry[1] > self.ttl:
+                self.misses += 1
+                return None
+        try:
+            reply = entry[0].result()
+        except Exception:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return reply
+
+    def _fetch(self, dfn, rpc_name, params):
+        with self._lock:
+            if dfn != self._dfn:
+                # Another patient was selected before this prefetch started.
+                raise LookupError(f"Patient {dfn} is no longer selected.")
+        try:
+            return self.call(rpc_name, list(params))
+        except Exception as e:
+            logging.warning(f"Prefetch of '{rpc_name}' for patient {dfn} failed: {e}")
+            raise
+
+    def load_usage(self):
+        """Loads usage counts and learned templates from usage_path, if it exists."""
+        try:
+            with open(self.usage_path, 'r') as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read prefetch usage from {self.usage_path}: {e}")
+            return
+        with self._lock:
+            self.usage.update(saved.get("usage", {}))
+            for rpc_name, template in saved.get("templates", {}).items():
+                if rpc_name not in self.read_only:
+                    logging.warning(f"Ignoring the saved prefetch template for '{rpc_name}': "
+                                    f"it is not a read-only RPC.")
+                    continue
+                self.templates.setdefault(rpc_name, tuple(DFN if value is None else value for value in template))
+
+    def save_usage(self):
+        """Saves usage counts and learned templates to usage_path."""
+        if not self.usage_path:
+            return
+        with self._lock:
+            saved = {
+                "usage": self.usage,
+                "templates": {rpc_name: [None if value is DFN else value for value in template]
+                              for rpc_name, template in self.templates.items()},
+            }
+            try:
+                with open(self.usage_path, 'w') as f:
+                    json.dump(saved, f, indent=2)
+            except OSError as e:
+                logging.warning(f"Could not save prefetch usage to {self.usage_path}: {e}")
+
+    def close(self):
+        """Saves usage counts and stops the prefetch workers."""
+        self.save_usage()
+        with self._lock:
+            for future, _ in self._entries.values():
+                future.cancel()
+            self._entries = {}
+        self._executor.shutdown(wait=False)
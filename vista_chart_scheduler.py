@@ -0,0 +1,126 @@
+import logging
+import queue
+import threading
+from collections import namedtuple
+
+# One RPC in a patient's chart pull. params is called with the patient's DFN
+# and returns the call's parameters, as for VistARPCClient.call_rpc.
+ChartStep = namedtuple("ChartStep", ["name", "rpc_name", "params"])
+
+# The outcome of one patient's chart pull. replies maps step names to the
+# replies received before the pull stopped; error is None if every step ran.
+ChartResult = namedtuple("ChartResult", ["dfn", "replies", "error"])
+
+
+def _dfn_only(dfn):
+    return [("literal", dfn)]
+
+
+def _signed_notes(dfn):
+    # CLASS 3 (progress notes), CONTEXT 1 (signed documents), DFN, EARLY, LATE.
+    return [("literal", "3"), ("literal", "1"), ("literal", dfn), ("literal", ""), ("literal", "")]
+
+
+# Select the patient, then read allergies, notes and labs.
+DEFAULT_CHART_STEPS = (
+    ChartStep("select", "ORWPT SELECT", _dfn_only),
+    ChartStep("allergies", "ORQQAL LIST", _dfn_only),
+    ChartStep("notes", "TIU DOCUMENTS BY CONTEXT", _signed_notes),
+    ChartStep("labs", "ORWLRR INTERIMG", _dfn_only),
+)
+
+
+class ChartScheduler:
+    """
+    Pulls patient charts in parallel without mixing up patients.
+
+    ORWPT SELECT sets the selected patient on the broker connection it is
+    sent on, and later RPCs on that connection answer for that patient. Each
+    patient's steps therefore run in order on one session checked out of the
+    pool for the whole pull, and no other patient's steps run on that session
+    until the pull is finished. Different patients run at the same time on
+    different sessions.
+    """
+
+    def __init__(self, pool, host, port, access_code, verify_code, context, steps=DEFAULT_CHART_STEPS,
+                 concurrency=4, timeout=None):
+        """
+        Initializes the ChartScheduler.
+
+        Args:
+            pool (VistARPCPool): The pool sessions are checked out of.
+            host, port, access_code, verify_code, context: As for VistARPCPool.checkout.
+            steps (sequence): The ChartSteps to run for each patient, in order.
+            concurrency (int): The number of patients pulled at once. The pool's
+                               max_size caps the number of sessions in use.
+            timeout (float, optional): Seconds each RPC call may take. Defaults to the pool's timeout.
+        """
+        self.pool = pool
+        self.credentials = (host, port, access_code, verify_code, context)
+        self.steps = tuple(steps)
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def pull_chart(self, dfn):
+        """
+        Runs every step for one patient on a single pooled session.
+
+        A step that fails stops the pull; the session is then discarded, as
+        it may be left with another patient selected.
+
+        Returns:
+            ChartResult: The replies, and the error that stopped the pull if any.
+        """
+        dfn = str(dfn)
+        replies = {}
+        try:
+            with self.pool.session(*self.credentials) as client:
+                limiter = self.pool.limiter_for(client.host, client.port)
+                for step in self.steps:
+                    if limiter is None:
+                        response = client._execute(step.rpc_name, step.params(dfn), self.timeout)
+                    else:
+                        with limiter.slot(rpc_name=step.rpc_name, sampled=client.sent_request):
+                            response = client._execute(step.rpc_name, step.params(dfn), self.timeout)
+                    replies[step.name] = response.decode().strip()
+                    if step.rpc_name == "ORWPT SELECT" and replies[step.name].startswith("-1"):
+                        raise LookupError(f"Patient {dfn} could not be selected.")
+        except Exception as e:
+            logging.error(f"Chart pull for patient {dfn} failed: {e}")
+            return ChartResult(dfn, replies, e)
+        return ChartResult(dfn, replies, None)
+
+    def pull_charts(self, dfns, on_result=None):
+        """
+        Pulls the charts of several patients, concurrency patients at a time.
+
+        Args:
+            dfns (iterable): The patients' DFNs.
+            on_result (callable, optional): Called with each ChartResult as soon as
+                                            it is ready, from a worker thread.
+
+        Returns:
+            list: A ChartResult for each patient, in the order of dfns.
+        """
+        dfns = list(dfns)
+        results = [None] * len(dfns)
+        pending = queue.SimpleQueue()
+        for index, dfn in enumerate(dfns):
+            pending.put((index, dfn))
+
+        def work():
+            while True:
+                try:
+                    index, dfn = pending.get_nowait()
+                except queue.Empty:
+                    return
+                results[index] = self.pull_chart(dfn)
+                if on_result is not None:
+                    on_result(results[index])
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(min(self.concurrency, len(dfns)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
@@ -0,0 +1,148 @@
+import itertools
+import logging
+import queue
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# A call that has been submitted and whose result has not been handled yet.
+Task = namedtuple("Task", ["task_id", "label", "started_at", "future"])
+
+
+class BackgroundTasks:
+    """
+    Runs blocking calls, such as broker round trips, off the Tk main loop.
+
+    Calls run on a small thread pool and put their outcome on a queue. The Tk
+    thread polls the queue with after() while calls are outstanding and runs
+    each call's on_done or on_error callback there, so callbacks may touch
+    widgets. Any number of calls can be outstanding at once.
+
+    Cancelling a call that has not started yet removes it; a call that is
+    already running cannot be interrupted, so its result is discarded when it
+    arrives. Either way on_done and on_error never run; on_cancel runs
+    instead, so a caller waiting for the call can reset its state.
+    """
+
+    def __init__(self, widget, workers=4, poll_interval=50, on_change=None):
+        """
+        Initializes the BackgroundTasks.
+
+        Args:
+            widget (tk.Misc): Any widget of the application, used to schedule polling.
+            workers (int): The number of calls run at once.
+            poll_interval (int): Milliseconds between polls of the result queue.
+            on_change (callable, optional): Called on the Tk thread with the list of
+                                            outstanding Tasks whenever it changes.
+        """
+        self.widget = widget
+        self.poll_interval = poll_interval
+        self.on_change = on_change
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gui-task")
+        self._results = queue.SimpleQueue()
+        self._tasks = {}        # task_id -> (Task, on_done, on_error)
+        self._ids = itertools.count(1)
+        self._polling = False
+
+    def submit(self, label, fn, *args, on_done=None, on_error=None, on_cancel=None):
+        """
+        Runs fn(*args) in the background.
+
+        Args:
+            label (str): What the call is, for the in-flight display.
+            fn (callable): The blocking call.
+            on_done (callable, optional): Called on the Tk thread with fn's result.
+            on_error (callable, optional): Called on the Tk thread with the exception fn raised.
+            on_cancel (callable, optional): Called on the Tk thread, without arguments,
+                                            if the call is cancelled.
+
+        Returns:
+            int: The task's id, for cancel.
+        """
+        task_id = next(self._ids)
+        future = self._executor.submit(self._run, task_id, fn, args)
+        self._tasks[task_id] = (Task(task_id, label, time.monotonic(), future), on_done, on_error, on_cancel)
+        self._changed()
+        if not self._polling:
+            self._polling = True
+            self.widget.after(self.poll_interval, self._poll)
+        return task_id
+
+    def cancel(self, task_id):
+        """
+        Cancels a call; its on_done and on_error callbacks will not run, its on_cancel callback does.
+
+        Must be called on the Tk thread.
+
+        Returns:
+            bool: True if the call was outstanding.
+        """
+        entry = self._tasks.pop(task_id, None)
+        if entry is None:
+            return False
+        task, _, _, on_cancel = entry
+        task.future.cancel()
+        self._changed()
+        if on_cancel is not None:
+            try:
+                on_cancel()
+            except Exception as e:
+                logging.error(f"Handling the cancellation of '{task.label}' failed: {e}")
+        return True
+
+    def cancel_all(self):
+        """Cancels every outstanding call."""
+        for task_id in list(self._tasks):
+            self.cancel(task_id)
+
+    def outstanding(self):
+        """Returns the outstanding Tasks, oldest first."""
+        return [entry[0] for entry in self._tasks.values()]
+
+    def shutdown(self):
+        """
+        Cancels outstanding calls and stops the workers without waiting for running calls.
+
+        No callbacks run, not even on_cancel, since the widgets are going away.
+        """
+        self._tasks.clear()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, task_id, fn, args):
+        try:
+            self._results.put((task_id, fn(*args), None))
+        except Exception as e:
+            self._results.put((task_id, None, e))
+
+    def _poll(self):
+        handled = False
+        while True:
+            try:
+                task_id, result, error = self._results.get_nowait()
+            except queue.Empty:
+                break
+            entry = self._tasks.pop(task_id, None)
+            if entry is None:
+                continue    # Cancelled while it ran.
+            handled = True
+            task, on_done, on_error, _ = entry
+            try:
+                if error is None:
+                    if on_done is not None:
+                        on_done(result)
+                elif on_error is not None:
+                    on_error(error)
+                else:
+                    logging.error(f"Background call '{task.label}' failed: {error}")
+            except Exception as e:
+                logging.error(f"Handling the result of '{task.label}' failed: {e}")
+        if handled:
+            self._changed()
+        if self._tasks:
+            self.widget.after(self.poll_interval, self._poll)
+        else:
+            self._polling = False
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change(self.outstanding())
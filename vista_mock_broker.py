@@ -0,0 +1,418 @@
+import argparse
+import logging
+import os
+import random
+import socketserver
+import threading
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+ET = b'\x04'  # End of Transmission (ASCII 4)
+LEGACY_PREFIX = b'[XWB]10304\r\n'   # The simplified sign-on of VistARPCClient, see its SIGNON_PREFIX
+NS_PREFIX = b'[XWB]11'              # RPC calls in the length-prefixed broker format
+
+# ORWPT LIST ALL answers one page of this many patients per call, like the real broker.
+PATIENT_PAGE_SIZE = 44
+
+SURNAMES = [
+    "ADAMS", "BAKER", "CLARK", "DAVIS", "EVANS", "FOSTER", "GARCIA", "HARRIS", "JACKSON", "JONES",
+    "KING", "LEWIS", "MARTIN", "MILLER", "NELSON", "PARKER", "ROBINSON", "SMITH", "SMITHERS", "TAYLOR",
+    "THOMAS", "WALKER", "WHITE", "WILSON", "YOUNG",
+]
+FIRST_NAMES = [
+    "ALICE", "BOB", "CAROL", "DAVID", "EMMA", "FRANK", "GRACE", "HENRY", "IRENE", "JAMES",
+    "KAREN", "LARRY", "MARY", "NANCY", "OSCAR", "PAUL", "RUTH", "SAM", "TINA", "WALTER",
+]
+NOTE_TITLES = ["PRIMARY CARE NOTE", "NURSING NOTE", "PHARMACY NOTE", "SOCIAL WORK NOTE", "CARDIOLOGY CONSULT"]
+
+DEFAULT_RPC_LIST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cprs_rpc_list.txt")
+
+
+def parse_rpc_message(data):
+    """
+    Parses one length-prefixed XWB RPC request from the start of data.
+
+    Args:
+        data (bytes): Received bytes, starting at a request.
+
+    Returns:
+        tuple: (rpc_name, params, consumed) where params is a list of
+               (param_type, value) tuples like those passed to call_rpc,
+               or None if data does not yet hold a complete request.
+
+    Raises:
+        ValueError: If the request is malformed.
+    """
+    # [XWB] 1 1 <width> 0 2 \x01 1 <name length> <name> 5 <params> \x04
+    if len(data) < 13:
+        return None
+    if not data.startswith(NS_PREFIX) or data[9:12] != b'2\x011':
+        raise ValueError("Not an XWB RPC request.")
+    width = int(data[7:8])
+    name_end = 13 + data[12]
+    if len(data) < name_end + 1:
+        return None
+    rpc_name = data[13:name_end].decode()
+    if data[name_end:name_end + 1] != b'5':
+        raise ValueError("Missing parameter section.")
+    pos = name_end + 1
+
+    def lpack(pos):
+        if len(data) < pos + width:
+            return None, pos
+        length = int(data[pos:pos + width])
+        end = pos + width + length
+        if len(data) < end:
+            return None, pos
+        return data[pos + width:end].decode(), end
+
+    params = []
+    while True:
+        if len(data) < pos + 1:
+            return None
+        kind = data[pos:pos + 1]
+        if kind == ET:
+            return rpc_name, params, pos + 1
+        if kind == b'4':
+            pos += 2
+        elif kind in (b'0', b'1'):
+            value, pos = lpack(pos + 1)
+            if value is None:
+                return None
+            params.append(('literal' if kind == b'0' else 'reference', value))
+            pos += 1
+        elif kind == b'2':
+            pos += 1
+            items = []
+            while True:
+                sub, pos = lpack(pos)
+                if sub is None:
+                    return None
+                val, pos = lpack(pos)
+                if val is None or len(data) < pos + 1:
+                    return None
+                items.append((sub, val))
+                pos += 1
+                if data[pos - 1:pos] == b'f':
+                    break
+            params.append(('list', items))
+        else:
+            raise ValueError(f"Unknown parameter type {kind!r}.")
+
+
+class MockVistABroker:
+    """
+    A stand-in VistA RPC Broker for exercising VistARPCClient without a VistA server.
+
+    Accepts the handshake and login sent by VistARPCClient, then answers RPC
+    calls with canned or generated replies. The generated data is
+    deterministic: a roster of patients, notes for every patient and the RPC
+    names listed in cprs_rpc_list.txt. Latency, reply size and errors can be
+    configured to exercise the client under load.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, access_code=None, verify_code=None,
+                 latency=0.0, jitter=0.0, reply_size=None, list_size=100, note_lines=60,
+                 notes_per_patient=10, patient_count=1000, error_rate=0.0, drop_rate=0.0,
+                 responses=None, rpc_list_path=DEFAULT_RPC_LIST_PATH, seed=None):
+        """
+        Initializes the MockVistABroker.
+
+        Args:
+            host (str): The address to listen on.
+            port (int): The port to listen on; 0 picks a free port.
+            access_code (str, optional): The only access code accepted; any if None.
+            verify_code (str, optional): The only verify code accepted; any if None.
+            latency (float): Seconds to wait before answering each RPC.
+            jitter (float): Extra random delay of up to this many seconds per RPC.
+            reply_size (int, optional): Size in bytes of the filler reply to RPCs with
+                                        no generated reply. Defaults to a short "1".
+            list_size (int): Number of rows in generated list replies.
+            note_lines (int): Number of lines in a generated note.
+            notes_per_patient (int): Number of notes each patient has.
+            patient_count (int): Number of patients in the roster.
+            error_rate (float): Fraction of RPCs answered with an application error.
+            drop_rate (float): Fraction of RPCs whose connection is dropped mid-reply.
+            responses (dict, optional): RPC name -> reply text, or a callable taking
+                                        (params, session) and returning reply text.
+                                        Overrides the generated replies.
+            rpc_list_path (str): File listing the RPC names the broker knows.
+            seed (int, optional): Seed for latency jitter and error injection.
+        """
+        self.address = (host, port)
+        self.access_code = access_code
+        self.verify_code = verify_code
+        self.latency = latency
+        self.jitter = jitter
+        self.reply_size = reply_size
+        self.list_size = list_size
+        self.note_lines = note_lines
+        self.notes_per_patient = notes_per_patient
+        self.error_rate = error_rate
+        self.drop_rate = drop_rate
+        self.responses = dict(responses or {})
+        self.call_counts = {}
+        self.connections = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+        self.rpc_names = []
+        try:
+            with open(rpc_list_path, 'r') as f:
+                self.rpc_names = [line.strip() for line in f if line.strip()]
+        except FileNotFoundError:
+            logging.warning(f"RPC list file not found: {rpc_list_path}. Only canned RPCs will be known.")
+
+        roster = []
+        for i in range(patient_count):
+            name = f"{SURNAMES[i % len(SURNAMES)]},{FIRST_NAMES[(i // len(SURNAMES)) % len(FIRST_NAMES)]}"
+            generation = i // (len(SURNAMES) * len(FIRST_NAMES))
+            if generation:
+                name += f" {generation}"
+            roster.append((name, str(100001 + i)))
+        roster.sort()
+        self.patients = roster
+        self._patients_by_dfn = {dfn: name for name, dfn in roster}
+
+        self._generators = {
+            "XWB CREATE CONTEXT": lambda params, session: "1",
+            "XWB IM HERE": lambda params, session: "1",
+            "XWB LIST ALL RPCS": lambda params, session: "\r\n".join(self.rpc_names),
+            "ORWU USERINFO": lambda params, session: "10000000020^DOCTOR,ONE^3^1^1^3^0^4000^20^1^1^20^0^0^0",
+            "ORWPT LIST ALL": self._patient_page,
+            "ORQPT PROVIDER PATIENTS": self._provider_patients,
+            "ORWPT SELECT": self._select_patient,
+            "ORQQAL LIST": self._allergies,
+            "TIU DOCUMENTS BY CONTEXT": self._note_list,
+            "TIU GET RECORD TEXT": self._note_text,
+            "ORWLRR INTERIMG": self._interim_labs,
+        }
+
+    # --- Lifecycle ---
+
+    def start(self):
+        """
+        Starts serving in a background thread.
+
+        Returns:
+            tuple: The (host, port) the broker is listening on.
+        """
+        broker = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                try:
+                    broker._serve_connection(self.request)
+                except ConnectionError:
+                    # Clients drop the connection mid-reply when a call times out or is cancelled.
+                    pass
+
+        self._server = socketserver.ThreadingTCPServer(self.address, Handler)
+        self._server.daemon_threads = True
+        self.address = self._server.server_address
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"Mock VistA RPC Broker listening on {self.address[0]}:{self.address[1]}")
+        return self.address
+
+    def stop(self):
+        """Stops serving and closes the listening socket."""
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    # --- Protocol ---
+
+    def _serve_connection(self, sock):
+        with self._lock:
+            self.connections += 1
+        session = {"logged_in": False, "handshake": False, "dfn": None}
+        data = bytearray()
+
+        while True:
+            message = self._next_message(data, session)
+            while message is None:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return
+                data += chunk
+                message = self._next_message(data, session)
+
+            kind, payload = message
+            if kind == 'handshake':
+                session["handshake"] = True
+                sock.sendall(b'accept' + ET)
+            elif kind == 'login':
+                access_code, _, verify_code = payload.partition(';')
+                accepted = ((self.access_code is None or access_code == self.access_code)
+                            and (self.verify_code is None or verify_code == self.verify_code))
+                session["logged_in"] = accepted
+                sock.sendall((b'\x01' + b'1' if accepted else b'\x00' + b'Not a valid ACCESS CODE/VERIFY CODE pair.') + ET)
+            else:
+                rpc_name, params = payload
+                if not self._answer_rpc(sock, session, rpc_name, params):
+                    return
+
+    def _next_message(self, data, session):
+        """Removes and returns the next complete message in data, or None if more data is needed."""
+        if data.startswith(LEGACY_PREFIX):
+            if not session["handshake"]:
+                del data[:len(LEGACY_PREFIX)]
+                return 'handshake', None
+            end = data.find(b'\r\n', len(LEGACY_PREFIX))
+            if end == -1:
+                return None
+            credentials = data[len(LEGACY_PREFIX):end].decode()
+            del data[:end + 2]
+            return 'login', credentials
+        if len(data) < len(LEGACY_PREFIX) and LEGACY_PREFIX.startswith(bytes(data)):
+            return None
+
+        if ET not in data:
+            return None
+        parsed = parse_rpc_message(bytes(data))
+        if parsed is None:
+            return None
+        rpc_name, params, consumed = parsed
+        del data[:consumed]
+        return 'rpc', (rpc_name, params)
+
+    def _answer_rpc(self, sock, session, rpc_name, params):
+        """Sends the reply to one RPC. Returns False if the connection was dropped."""
+        with self._lock:
+            self.call_counts[rpc_name] = self.call_counts.get(rpc_name, 0) + 1
+            roll = self._random.random()
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay:
+            time.sleep(delay)
+
+        if not session["logged_in"]:
+            sock.sendall(self._error_reply("Not logged in.", security=True))
+            return True
+        if roll < self.drop_rate:
+            sock.sendall(b'\x00\x00' + b'partial reply')
+            sock.close()
+            return False
+        if roll < self.drop_rate + self.error_rate:
+            sock.sendall(self._error_reply(f"Injected error in {rpc_name}."))
+            return True
+
+        generator = self.responses.get(rpc_name, self._generators.get(rpc_name))
+        if generator is None and rpc_name not in self.rpc_names:
+            sock.sendall(self._error_reply(f"Remote Procedure '{rpc_name}' doesn't exist on the server."))
+            return True
+
+        if generator is None:
+            reply = "1" if self.reply_size is None else "X" * self.reply_size
+        elif callable(generator):
+            reply = generator(params, session)
+        else:
+            reply = generator
+        sock.sendall(b'\x00\x00' + reply.encode() + ET)
+        return True
+
+    @staticmethod
+    def _error_reply(message, security=False):
+        text = message.encode()[:255]
+        segment = bytes([len(text)]) + text
+        return (segment + b'\x00' if security else b'\x00' + segment) + ET
+
+    # --- Generated replies ---
+
+    @staticmethod
+    def _param(params, index, default=""):
+        return params[index][1] if len(params) > index else default
+
+    def _patient_page(self, params, session):
+        """ORWPT LIST ALL: the next page of patients whose names sort after FROM."""
+        start = self._param(params, 0).upper()
+        rows = [f"{dfn}^{name}" for name, dfn in self.patients if name > start][:PATIENT_PAGE_SIZE]
+        return "\r\n".join(rows)
+
+    def _provider_patients(self, params, session):
+        return "\r\n".join(f"{dfn}^{name}" for name, dfn in self.patients[:self.list_size])
+
+    def _select_patient(self, params, session):
+        dfn = self._param(params, 0)
+        name = self._patients_by_dfn.get(dfn)
+        if name is None:
+            return "-1"
+        session["dfn"] = dfn
+        return f"{name}^M^2450101^666{dfn[-6:]}^^^^^^0^0^^^^0^0"
+
+    def _allergies(self, params, session):
+        return "\r\n".join(f"{i}^ALLERGEN {i}^^MILD" for i in range(1, 4))
+
+    def _note_list(self, params, session):
+        """TIU DOCUMENTS BY CONTEXT (CLASS, CONTEXT, DFN, EARLY, LATE, ...): notes dated after EARLY."""
+        dfn = self._param(params, 2, session["dfn"] or "")
+        if dfn not in self._patients_by_dfn:
+            return ""
+        early = float(self._param(params, 3) or 0)
+        late = float(self._param(params, 4) or 9999999)
+        rows = []
+        for i in range(self.notes_per_patient):
+            ien = int(dfn) * 1000 + i
+            # FileMan dates: year - 1700, then month and day; one note a week from 1 Jan 2024.
+            day = 1 + (i * 7) % 28
+            month = 1 + (i * 7) // 28 % 12
+            ref_date = 3240000 + month * 100 + day + 0.09
+            if early <= ref_date <= late:
+                rows.append(f"{ien}^{NOTE_TITLES[i % len(NOTE_TITLES)]}^{ref_date}^"
+                            f"{self._patients_by_dfn[dfn]}^10000000020;DOCTOR,ONE^CLINIC^completed")
+        return "\r\n".join(rows)
+
+    def _note_text(self, params, session):
+        ien = self._param(params, 0)
+        line = f"Note {ien}: patient seen and examined, plan reviewed with the patient. "
+        return "\r\n".join(f"{n:04d} {line}" for n in range(self.note_lines))
+
+    def _interim_labs(self, params, session):
+        """ORWLRR INTERIMG (DFN, DATE, DIR, FORMAT): an interim lab report, for the selected patient by default."""
+        dfn = self._param(params, 0) or session["dfn"] or ""
+        name = self._patients_by_dfn.get(dfn)
+        if name is None:
+            return ""
+        lines = [f"Patient: {name} ({dfn})"]
+        for i, test in enumerate(("GLUCOSE", "SODIUM", "POTASSIUM", "CREATININE")):
+            lines.append(f"{test}^{90 + int(dfn) % 7 + i}^^{3240101.09 + i}")
+        return "\r\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a mock VistA RPC Broker.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9297)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each reply.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random delay per reply, in seconds.")
+    parser.add_argument("--reply-size", type=int, default=None, help="Bytes in filler replies.")
+    parser.add_argument("--list-size", type=int, default=100, help="Rows in generated list replies.")
+    parser.add_argument("--note-lines", type=int, default=60, help="Lines in a generated note.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of RPCs answered with an error.")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of RPCs whose connection is dropped.")
+    args = parser.parse_args()
+
+    broker = MockVistABroker(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                             reply_size=args.reply_size, list_size=args.list_size, note_lines=args.note_lines,
+                             error_rate=args.error_rate, drop_rate=args.drop_rate)
+    broker.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        broker.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+import argparse
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# One TIU note as listed by TIU DOCUMENTS BY CONTEXT, with its text once fetched.
+# ref_date is the note's FileMan reference date, e.g. "3240115.09".
+Note = namedtuple("Note", ["ien", "dfn", "title", "ref_date", "author", "location", "status", "text"])
+
+# One full-text search match. snippet is an excerpt of the note text around
+# the matched terms, with the terms wrapped in [ ].
+SearchHit = namedtuple("SearchHit", ["ien", "dfn", "title", "ref_date", "snippet"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS notes (
+    ien TEXT PRIMARY KEY,
+    dfn TEXT NOT NULL,
+    title TEXT,
+    ref_date TEXT,
+    author TEXT,
+    location TEXT,
+    status TEXT,
+    text TEXT
+);
+CREATE INDEX IF NOT EXISTS notes_by_patient ON notes (dfn, ref_date);
+CREATE TABLE IF NOT EXISTS sync_state (
+    dfn TEXT PRIMARY KEY,
+    high_water TEXT NOT NULL,
+    synced_at REAL NOT NULL
+);
+"""
+
+# An FTS5 index over note titles and text. It is an external content table,
+# so the text is stored once, in notes, and triggers keep the index in step.
+# The DFN is indexed too, so searches within one patient's notes are narrowed
+# inside the index instead of by filtering every match afterwards.
+_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE notes_fts USING fts5(dfn, title, text, content='notes', content_rowid='rowid');
+CREATE TRIGGER notes_fts_insert AFTER INSERT ON notes BEGIN
+    INSERT INTO notes_fts (rowid, dfn, title, text) VALUES (new.rowid, new.dfn, new.title, new.text);
+END;
+CREATE TRIGGER notes_fts_delete AFTER DELETE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, dfn, title, text)
+        VALUES ('delete', old.rowid, old.dfn, old.title, old.text);
+END;
+CREATE TRIGGER notes_fts_update AFTER UPDATE ON notes BEGIN
+    INSERT INTO notes_fts (notes_fts, rowid, dfn, title, text)
+        VALUES ('delete', old.rowid, old.dfn, old.title, old.text);
+    INSERT INTO notes_fts (rowid, dfn, title, text) VALUES (new.rowid, new.dfn, new.title, new.text);
+END;
+INSERT INTO notes_fts (notes_fts) VALUES ('rebuild');
+"""
+
+_UPSERT_NOTE = (
+    "INSERT INTO notes (ien, dfn, title, ref_date, author, location, status, text) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (ien) DO UPDATE SET dfn = excluded.dfn, title = excluded.title, ref_date = excluded.ref_date, "
+    "author = excluded.author, location = excluded.location, status = excluded.status, text = excluded.text"
+)
+
+
+class NoteStore:
+    """
+    A local SQLite store of TIU notes and of how far each patient's notes have been synced.
+
+    Note titles and text are indexed with FTS5, so search() answers from the
+    local store without a broker round trip. Notes are written in batches,
+    one transaction per batch, which keeps bulk loads fast.
+
+    The store can be shared between threads; writes are serialized.
+    """
+
+    def __init__(self, path):
+        """
+        Initializes the NoteStore, creating the database if needed.
+
+        Args:
+            path (str): The SQLite database file, or ":memory:".
+        """
+        self.path = path
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            if path != ":memory:":
+                # Readers are not blocked by a sync writing, and commits do not wait for a full fsync.
+                self._db.execute("PRAGMA journal_mode = WAL")
+                self._db.execute("PRAGMA synchronous = NORMAL")
+            with self._db:
+                self._db.executescript(_SCHEMA)
+            indexed = self._db.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'").fetchone()
+            if not indexed:
+                # Also indexes the notes of a store created before the index existed.
+                self._db.executescript("BEGIN;" + _FTS_SCHEMA + "COMMIT;")
+
+    def high_water(self, dfn):
+        """
+        Returns the FileMan date of the newest note synced for a patient.
+
+        Returns:
+            str: The date, or None if the patient has never been synced.
+        """
+        with self._lock:
+            row = self._db.execute("SELECT high_water FROM sync_state WHERE dfn = ?", (str(dfn),)).fetchone()
+        return row[0] if row else None
+
+    def known_iens(self, dfn, since=None):
+        """
+        Returns the IENs of the stored notes of a patient.
+
+        Args:
+            dfn (str): The patient's DFN.
+            since (str, optional): Only notes dated on or after this FileMan date.
+
+        Returns:
+            set: The IENs, as strings.
+        """
+        query = "SELECT ien FROM notes WHERE dfn = ?"
+        args = [str(dfn)]
+        if since is not None:
+            query += " AND CAST(ref_date AS REAL) >= ?"
+            args.append(float(since))
+        with self._lock:
+            return {row[0] for row in self._db.execute(query, args)}
+
+    def save_sync(self, dfn, notes, high_water):
+        """
+        Stores a patient's new notes and advances their high-water mark, in one transaction.
+
+        Args:
+            dfn (str): The patient's DFN.
+            notes (list): The Notes to store; notes already stored are replaced.
+            high_water (str): The FileMan date of the newest note seen, or None to
+                              keep the current mark.
+        """
+        dfn = str(dfn)
+        with self._lock, self._db:
+            self._db.executemany(_UPSERT_NOTE, notes)
+            if high_water is not None:
+                self._db.execute(
+                    "INSERT INTO sync_state (dfn, high_water, synced_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (dfn) DO UPDATE SET high_water = excluded.high_water, synced_at = excluded.synced_at",
+                    (dfn, high_water, time.time()))
+
+    def add_notes(self, notes):
+        """
+        Stores a batch of notes in one transaction, replacing notes already stored.
+
+        Args:
+            notes (iterable): Notes, or tuples in the same field order.
+
+        Returns:
+            int: The number of notes written.
+        """
+        with self._lock, self._db:
+            cursor = self._db.executemany(_UPSERT_NOTE, notes)
+        return cursor.rowcount
+
+    def search(self, query, dfn=None, limit=50, raw=False):
+        """
+        Finds notes whose title or text match a query, best matches first.
+
+        Args:
+            query (str): Words that must all occur. The last word also matches
+                         as a prefix, so partially typed words find their notes.
+            dfn (str, optional): Only search this patient's notes.
+            limit (int): The maximum number of hits.
+            raw (bool): Pass query to FTS5 as is, for its full query syntax
+                        (phrases, OR, NEAR, column filters).
+
+        Returns:
+            list: SearchHits ranked by relevance.
+        """
+        match = query if raw else self._match_expression(query)
+        if not match:
+            return []
+        match = f"{{title text}} : ({match})"
+        if dfn is not None:
+            match = 'dfn : "' + str(dfn).replace('"', '""') + f'" AND {match}'
+        sql = ("SELECT notes.ien, notes.dfn, notes.title, notes.ref_date, "
+               "snippet(notes_fts, 2, '[', ']', '...', 12) "
+               "FROM notes_fts JOIN notes ON notes.rowid = notes_fts.rowid "
+               "WHERE notes_fts MATCH ? ORDER BY notes_fts.rank LIMIT ?")
+        with self._lock:
+            return [SearchHit(*row) for row in self._db.execute(sql, (match, limit))]
+
+    @staticmethod
+    def _match_expression(query):
+        """Quotes each word of a plain query so FTS5 operators and punctuation in it are taken literally."""
+        terms = ['"' + term.replace('"', '""') + '"' for term in query.split()]
+        if terms:
+            terms[-1] += '*'
+        return " ".join(terms)
+
+    def notes_for(self, dfn):
+        """Returns the stored Notes of a patient, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT ien, dfn, title, ref_date, author, location, status, text FROM notes "
+                "WHERE dfn = ? ORDER BY CAST(ref_date AS REAL)", (str(dfn),)).fetchall()
+        return [Note(*row) for row in rows]
+
+    def close(self):
+        """Closes the database."""
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search the notes in a local note store.")
+    parser.add_argument("query", help="Words to search for.")
+    parser.add_argument("--db", default="notes.db", help="The SQLite note store.")
+    parser.add_argument("--dfn", help="Only search this patient's notes.")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    with NoteStore(args.db) as store:
+        start = time.perf_counter()
+        hits = store.search(args.query, dfn=args.dfn, limit=args.limit)
+        elapsed = time.perf_counter() - start
+    for hit in hits:
+        print(f"{hit.ref_date}  {hit.dfn:>8}  {hit.ien:>10}  {hit.title}: {hit.snippet}")
+    print(f"{len(hits)} hit(s) in {elapsed * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    main()
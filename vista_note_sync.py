@@ -0,0 +1,155 @@
+import argparse
+import logging
+import queue
+import threading
+from collections import namedtuple
+
+from vista_note_store import Note, NoteStore
+from vista_rpc_pool import VistARPCPool
+
+# The outcome of syncing one patient: the number of notes listed in the sync
+# window, how many of them were new and stored, and the error if the sync failed.
+SyncResult = namedtuple("SyncResult", ["dfn", "listed", "stored", "error"])
+
+# TIU DOCUMENTS BY CONTEXT class and context: progress notes, signed documents.
+NOTE_CLASS = "3"
+NOTE_CONTEXT = "1"
+
+
+class NoteSync:
+    """
+    Incrementally copies patients' TIU notes into a NoteStore.
+
+    Each patient has a high-water mark: the reference date of the newest note
+    synced so far. A sync only lists notes dated on or after the mark, and only
+    fetches the text of notes whose IEN is not stored yet, so a nightly run
+    costs in proportion to the new notes rather than to the size of the chart.
+    The window includes the mark itself, so notes filed later with the same
+    reference date are not missed; the stored IENs keep them from being
+    fetched twice.
+
+    Notes are fetched on sessions from a VistARPCPool, one patient per session,
+    several patients at a time.
+    """
+
+    def __init__(self, pool, host, port, access_code, verify_code, context, store, concurrency=4,
+                 timeout=None):
+        """
+        Initializes the NoteSync.
+
+        Args:
+            pool (VistARPCPool): The pool sessions are checked out of.
+            host, port, access_code, verify_code, context: As for VistARPCPool.checkout.
+            store (NoteStore): Where notes and high-water marks are kept.
+            concurrency (int): The number of patients synced at once.
+            timeout (float, optional): Seconds each RPC call may take. Defaults to the pool's timeout.
+        """
+        self.pool = pool
+        self.credentials = (host, port, access_code, verify_code, context)
+        self.store = store
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    def sync_patient(self, dfn):
+        """
+        Brings one patient's notes up to date.
+
+        Nothing is stored, and the mark does not move, unless every new note's
+        text was fetched.
+
+        Returns:
+            SyncResult: What the sync did.
+        """
+        dfn = str(dfn)
+        since = self.store.high_water(dfn)
+        try:
+            with self.pool.session(*self.credentials) as client:
+                listing = client.call_rpc_response(
+                    "TIU DOCUMENTS BY CONTEXT",
+                    [("literal", NOTE_CLASS), ("literal", NOTE_CONTEXT), ("literal", dfn),
+                     ("literal", since or ""), ("literal", "")],
+                    timeout=self.timeout)
+                known = self.store.known_iens(dfn, since)
+                new_notes = []
+                high_water = since
+                for record in listing:
+                    ien, ref_date = record.get(0), record.get(2)
+                    if not ien:
+                        continue
+                    if ref_date and (high_water is None or float(ref_date) > float(high_water)):
+                        high_water = ref_date
+                    if ien in known:
+                        continue
+                    text = client.call_rpc_response("TIU GET RECORD TEXT", [("literal", ien)],
+                                                    timeout=self.timeout).text
+                    new_notes.append(Note(ien, dfn, record.get(1), ref_date, record.get(4), record.get(5),
+                                          record.get(6), text))
+        except Exception as e:
+            logging.error(f"Note sync for patient {dfn} failed: {e}")
+            return SyncResult(dfn, 0, 0, e)
+
+        self.store.save_sync(dfn, new_notes, high_water)
+        return SyncResult(dfn, len(listing), len(new_notes), None)
+
+    def sync(self, dfns, on_result=None):
+        """
+        Syncs several patients, concurrency patients at a time.
+
+        Args:
+            dfns (iterable): The patients' DFNs.
+            on_result (callable, optional): Called with each SyncResult as soon as
+                                            it is ready, from a worker thread.
+
+        Returns:
+            list: A SyncResult for each patient, in the order of dfns.
+        """
+        dfns = list(dfns)
+        results = [None] * len(dfns)
+        pending = queue.SimpleQueue()
+        for index, dfn in enumerate(dfns):
+            pending.put((index, dfn))
+
+        def work():
+            while True:
+                try:
+                    index, dfn = pending.get_nowait()
+                except queue.Empty:
+                    return
+                results[index] = self.sync_patient(dfn)
+                if on_result is not None:
+                    on_result(results[index])
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(min(self.concurrency, len(dfns)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy new TIU notes for a list of patients into a local store.")
+    parser.add_argument("dfns", nargs="+", help="DFNs of the patients to sync.")
+    parser.add_argument("--db", default="notes.db", help="The SQLite note store.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9297)
+    parser.add_argument("--access", required=True, help="Access code.")
+    parser.add_argument("--verify", required=True, help="Verify code.")
+    parser.add_argument("--context", default="OR CPRS GUI CHART")
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    pool = VistARPCPool(max_size=args.concurrency)
+    with NoteStore(args.db) as store:
+        note_sync = NoteSync(pool, args.host, args.port, args.access, args.verify, args.context, store,
+                             concurrency=args.concurrency)
+        results = note_sync.sync(args.dfns)
+    pool.close()
+    stored = sum(result.stored for result in results)
+    failed = [result.dfn for result in results if result.error is not None]
+    print(f"Synced {len(results) - len(failed)} patient(s), {stored} new note(s).")
+    if failed:
+        print(f"Failed: {', '.join(failed)}")
+
+if __name__ == "__main__":
+    main()
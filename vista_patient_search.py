@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+# What is known about the patients whose names start with a query: those the
+# broker has returned so far, in name order, whether that is all of them, and
+# the last name the broker returned, where a further page would continue from.
+_Entry = namedtuple("_Entry", ["patients", "complete", "last_name", "fetched_at"])
+
+
+class PatientSearchCache:
+    """
+    Answers patient name searches from earlier searches where it can.
+
+    ORWPT LIST ALL returns one page of names in order, starting after a given
+    name. A search for a prefix keeps the page's matches, and knows it has all
+    of them once the page reaches a name past the prefix. A longer query
+    ("SMI" then "SMIT") is answered by filtering the cached matches of its
+    longest cached prefix; the broker is only asked, continuing from the last
+    name cached, when those matches run out before the query's names do.
+
+    Entries expire after ttl seconds, so newly registered patients show up,
+    and the least recently used are dropped beyond max_entries.
+    The cache can be shared between threads.
+    """
+
+    def __init__(self, fetch_page, max_entries=64, ttl=300):
+        """
+        Initializes the PatientSearchCache.
+
+        Args:
+            fetch_page (callable): fetch_page(from_name) returns the next page of
+                                   patients after from_name, as {"DFN", "Name"} dicts
+                                   in name order, or an empty list past the last one.
+            max_entries (int): The number of queries kept.
+            ttl (float): Seconds a query's results are reused.
+        """
+        self.fetch_page = fetch_page
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # query -> _Entry
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(query):
+        """Returns query as it is looked up: trimmed and upper case, like VistA names."""
+        return query.strip().upper()
+
+    def _cached(self, query):
+        """Returns (patients, complete, last_name) for query from its longest cached prefix, or None."""
+        now = time.monotonic()
+        for length in range(len(query), 0, -1):
+            key = query[:length]
+            entry = self._entries.get(key)
+            if entry is None:
+                continue
+            if now - entry.fetched_at > self.ttl:
+                del self._entries[key]
+                continue
+            self._entries.move_to_end(key)
+            if length == len(query):
+                return entry.patients, entry.complete, entry.last_name
+            patients = [patient for patient in entry.patients if patient["Name"].upper().startswith(query)]
+            # Names are in order, so once the broker has returned a name past the query's, it has returned all of them.
+            last = entry.last_name.upper()
+            complete = entry.complete or (last > query and not last.startswith(query))
+            return patients, complete, entry.last_name
+        return None
+
+    def lookup(self, query):
+        """
+        Answers a search from the cache alone.
+
+        Returns:
+            list: All patients whose names start with query, or None if the
+                  cache does not have all of them.
+        """
+        query = self.normalize(query)
+        with self._lock:
+            cached = self._cached(query)
+            if cached is None or not cached[1]:
+                return None
+            self.hits += 1
+            return list(cached[0])
+
+    def search(self, query):
+        """
+        Finds patients whose names start with query, fetching a page from the broker if the cache runs out.
+
+        Returns:
+            tuple: (patients, complete). complete is False when more matches
+                   may follow the patients returned.
+        """
+        query = self.normalize(query)
+        with self._lock:
+            cached = self._cached(query)
+            if cached is not None and (cached[1] or query in self._entries):
+                # A query searched before keeps its page; more of it is fetched by whoever pages through it.
+                self.hits += 1
+                return list(cached[0]), cached[1]
+            self.misses += 1
+
+        patients, from_name = [], query
+        if cached is not None:
+            patients = list(cached[0])
+            from_name = max(query, cached[2])
+        page = self.fetch_page(from_name)
+        patients += [patient for patient in page if patient["Name"].upper().startswith(query)]
+        complete = not page or not page[-1]["Name"].upper().startswith(query)
+        entry = _Entry(patients, complete, page[-1]["Name"] if page else from_name, time.monotonic())
+
+        with self._lock:
+            self._entries[query] = entry
+            self._entries.move_to_end(query)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return list(patients), complete
+
+    def clear(self):
+        """Forgets every cached search."""
+        with self._lock:
+            self._entries.clear()
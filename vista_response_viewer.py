@@ -0,0 +1,186 @@
+import re
+import tkinter as tk
+from array import array
+from tkinter import ttk, scrolledtext
+
+# The most characters of a reply held in the text widget at once.
+WINDOW_CHARS = 200_000
+
+# Characters inserted per idle callback while a window is drawn.
+CHUNK_CHARS = 16_384
+
+
+class ResponseViewer(ttk.Frame):
+    """
+    Shows RPC replies of any size without freezing the window.
+
+    The reply is kept as a string outside the widget, and only a window of
+    about window_chars characters of it is in the text widget at a time,
+    starting at a line boundary. A window is inserted chunk_chars at a time
+    from idle callbacks, so Tk keeps handling events while a large reply is
+    drawn. The toolbar pages through the windows, finds text anywhere in the
+    reply, and jumps to a line; the window moves to wherever it leads.
+    """
+
+    def __init__(self, master, window_chars=WINDOW_CHARS, chunk_chars=CHUNK_CHARS, **text_options):
+        """
+        Initializes the ResponseViewer.
+
+        Args:
+            master (tk.Misc): The parent widget.
+            window_chars (int): The most characters held in the text widget.
+            chunk_chars (int): Characters inserted per idle callback.
+            **text_options: Passed to the ScrolledText, e.g. wrap and height.
+        """
+        super().__init__(master)
+        self.window_chars = window_chars
+        self.chunk_chars = chunk_chars
+        self.reply = ""
+        self.start = 0          # The window shown is reply[start:end].
+        self.end = 0
+        self._lines = None      # Offsets of the reply's newlines, indexed on first use
+        self._match = None      # (start, end) of the last match found
+        self._see = None        # Reply offset to scroll to once the window is drawn
+        self._render_job = None
+
+        toolbar = ttk.Frame(self)
+        toolbar.grid(row=0, column=0, sticky="ew")
+        ttk.Button(toolbar, text="< Prev", width=7, command=lambda: self.page(-1)).pack(side="left")
+        ttk.Button(toolbar, text="Next >", width=7, command=lambda: self.page(1)).pack(side="left", padx=(2, 10))
+        self.find_entry = ttk.Entry(toolbar, width=20)
+        self.find_entry.pack(side="left")
+        self.find_entry.bind("<Return>", lambda event: self.find(self.find_entry.get()))
+        ttk.Button(toolbar, text="Find", width=6, command=lambda: self.find(self.find_entry.get())).pack(
+            side="left", padx=(2, 10))
+        ttk.Label(toolbar, text="Line:").pack(side="left")
+        self.line_entry = ttk.Entry(toolbar, width=8)
+        self.line_entry.pack(side="left")
+        self.line_entry.bind("<Return>", lambda event: self._go_to_entered_line())
+        ttk.Button(toolbar, text="Go", width=4, command=self._go_to_entered_line).pack(side="left", padx=(2, 10))
+        self.position_label = ttk.Label(toolbar, text="")
+        self.position_label.pack(side="left")
+
+        self.text = scrolledtext.ScrolledText(self, state=tk.DISABLED, **text_options)
+        self.text.grid(row=1, column=0, sticky="nsew")
+        self.text.tag_configure("match", background="yellow")
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(1, weight=1)
+
+    def show(self, reply):
+        """Shows a reply from its start, replacing what is shown."""
+        self.reply = reply or ""
+        self._lines = None
+        self._match = None
+        self._see = None
+        self._show_window(0)
+
+    def page(self, direction):
+        """Shows the next (direction 1) or previous (direction -1) window of the reply."""
+        if direction > 0 and self.end < len(self.reply):
+            self._show_window(self.end)
+        elif direction < 0 and self.start > 0:
+            self._show_window(self._line_start(max(0, self.start - self.window_chars)))
+
+    def find(self, text):
+        """
+        Finds the next occurrence of text in the reply, ignoring case, and shows it.
+
+        The search continues after the last match, or from the top of the
+        window, and wraps around to the start of the reply.
+
+        Returns:
+            bool: True if text was found.
+        """
+        if not text:
+            return False
+        pattern = re.compile(re.escape(text), re.IGNORECASE)
+        position = self._match[1] if self._match else self.start
+        match = pattern.search(self.reply, position) or pattern.search(self.reply, 0)
+        if match is None:
+            self.position_label.config(text=f"'{text}' not found")
+            return False
+        self._match = match.span()
+        self._show_offset(match.start())
+        return True
+
+    def go_to_line(self, line):
+        """Shows a line of the reply, counting from 1."""
+        if not self.reply:
+            return
+        lines = self._line_index()
+        line = max(1, min(line, len(lines) + 1))
+        self._show_offset(lines[line - 2] + 1 if line > 1 else 0)
+
+    def _go_to_entered_line(self):
+        try:
+            self.go_to_line(int(self.line_entry.get()))
+        except ValueError:
+            self.position_label.config(text="Enter a line number")
+
+    def _line_index(self):
+        if self._lines is None:
+            lines = array('q')
+            position = self.reply.find('\n')
+            while position != -1:
+                lines.append(position)
+                position = self.reply.find('\n', position + 1)
+            self._lines = lines
+        return self._lines
+
+    def _line_start(self, offset):
+        start = self.reply.rfind('\n', 0, offset) + 1
+        # A reply without line breaks cannot be cut at one.
+        return start if offset - start < self.window_chars // 2 else offset
+
+    def _show_offset(self, offset):
+        """Scrolls to a reply offset, moving the window there if it is outside."""
+        self._see = offset
+        if not self.start <= offset < self.end:
+            self._show_window(self._line_start(offset))
+        elif self._render_job is None:
+            self._finish_render()
+
+    def _show_window(self, start):
+        if self._render_job is not None:
+            self.after_cancel(self._render_job)
+            self._render_job = None
+        end = min(len(self.reply), start + self.window_chars)
+        if end < len(self.reply):
+            # End at a line break if there is one nearby.
+            newline = self.reply.find('\n', end, end + self.chunk_chars)
+            if newline != -1:
+                end = newline + 1
+        self.start, self.end = start, end
+        self.text.config(state=tk.NORMAL)
+        self.text.delete(1.0, tk.END)
+        self.text.config(state=tk.DISABLED)
+        self._render(start)
+
+    def _render(self, position):
+        chunk_end = min(self.end, position + self.chunk_chars)
+        self.text.config(state=tk.NORMAL)
+        self.text.insert(tk.END, self.reply[position:chunk_end])
+        self.text.config(state=tk.DISABLED)
+        if chunk_end < self.end:
+            self._render_job = self.after_idle(self._render, chunk_end)
+            self.position_label.config(text=f"Loading... {chunk_end - self.start:,} of {self.end - self.start:,}")
+        else:
+            self._render_job = None
+            self._finish_render()
+
+    def _finish_render(self):
+        self.text.tag_remove("match", 1.0, tk.END)
+        if self._match and self.start <= self._match[0] and self._match[1] <= self.end:
+            self.text.tag_add("match", self._index(self._match[0]), self._index(self._match[1]))
+        if self._see is not None:
+            self.text.see(self._index(self._see))
+            self._see = None
+        if self.reply:
+            line = self.reply.count('\n', 0, self.start) + 1
+            self.position_label.config(
+                text=f"Line {line:,}, characters {self.start + 1:,}-{self.end:,} of {len(self.reply):,}")
+        else:
+            self.position_label.config(text="")
+
+    def _index(self, offset):
+        return f"1.0 + {offset - self.start} chars"
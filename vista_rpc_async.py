@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import random
+import time
+
+from vista_rpc_client import ET, SIGNON_PREFIX, VistARPCError, encode_rpc_message_parts, parse_reply_header
+from vista_rpc_metrics import default_registry
+
+
+class AsyncVistARPCClient:
+    """
+    An asyncio client for making RPC calls to a VistA server.
+
+    Mirrors VistARPCClient, but every network method is a coroutine, so one
+    event loop can drive many broker connections at once. A connection still
+    carries a single request at a time; concurrent calls on the same client
+    are queued in order.
+    """
+
+    def __init__(self, host, port, access_code, verify_code, context, metrics=None,
+                 log_bodies=False, body_log_sample_rate=1.0):
+        """
+        Initializes the AsyncVistARPCClient.
+
+        Args:
+            host (str): The VistA server hostname or IP address.
+            port (int): The port number for the VistA RPC Broker.
+            access_code (str): The user's access code for authentication.
+            verify_code (str): The user's verify code for authentication.
+            context (str): The application context for the RPC calls.
+            metrics (RPCMetricsRegistry, optional): Where per-RPC metrics are recorded.
+                                                    Defaults to vista_rpc_metrics.default_registry.
+            log_bodies (bool): Log the full text of RPC replies. Off by default.
+            body_log_sample_rate (float): The fraction of replies logged when log_bodies is on.
+        """
+        self.host = host
+        self.port = port
+        self.access_code = access_code
+        self.verify_code = verify_code
+        self.context = context
+        self.metrics = default_registry if metrics is None else metrics
+        self.log_bodies = log_bodies
+        self.body_log_sample_rate = body_log_sample_rate
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        self._lock = asyncio.Lock()
+
+    async def connect(self):
+        """Establishes a connection to the VistA server."""
+        try:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            self.connected = True
+            logging.info(f"Successfully connected to {self.host}:{self.port}")
+            await self._perform_handshake()
+        except ConnectionRefusedError:
+            logging.error(f"Connection refused. Is the VistA RPC Broker running on {self.host}:{self.port}?")
+            self.connected = False
+        except Exception as e:
+            logging.error(f"An error occurred during connection: {e}")
+            self.connected = False
+
+    async def _perform_handshake(self):
+        """Performs the initial handshake, in the mock broker's simplified sign-on (see SIGNON_PREFIX)."""
+        handshake_message = SIGNON_PREFIX
+        async with self._lock:
+            self.writer.write(handshake_message)
+            await self.writer.drain()
+            response = await self._read_response()
+        logging.info(f"Handshake response: {response.decode().strip()}")
+
+    async def login(self):
+        """Logs in with the provided credentials, in the mock broker's simplified sign-on (see SIGNON_PREFIX)."""
+        if not self.connected:
+            logging.error("Cannot log in without a connection.")
+            return
+
+        login_message = SIGNON_PREFIX + f"{self.access_code};{self.verify_code}\r\n".encode()
+        async with self._lock:
+            self.writer.write(login_message)
+            await self.writer.drain()
+            response = await self._read_response()
+        logging.info(f"Login response: {response.decode().strip()}")
+
+        if not response.startswith(b'\x01'):
+            logging.error("Login failed. Please check your access and verify codes.")
+            await self.disconnect()
+            return False
+
+        logging.info("Login successful.")
+        return True
+
+    async def create_context(self):
+        """
+        Creates the application context for making RPC calls.
+
+        Returns:
+            str: The broker's reply, or None if the context could not be created.
+        """
+        if not self.connected:
+            logging.error("Cannot create context without a connection.")
+            return
+
+        return await self.call_rpc("XWB CREATE CONTEXT", [("literal", self.context)])
+
+    async def call_rpc(self, rpc_name, params=None):
+        """
+        Makes an RPC call to the VistA server.
+
+        Args:
+            rpc_name (str): The name of the RPC to call.
+            params (list, optional): A list of tuples, where each tuple represents a parameter
+                                     in the format (param_type, value). Defaults to None.
+
+        Returns:
+            str: The response from the RPC call, or None if an error occurs.
+        """
+        if not self.connected:
+            logging.error("Cannot make an RPC call without a connection.")
+            return None
+
+        if params is None:
+            params = []
+
+        try:
+            response = await self._invoke(rpc_name, params)
+            decoded_response = response.decode().strip()
+            if self.log_bodies and random.random() < self.body_log_sample_rate:
+                logging.info(f"RPC response for '{rpc_name}': {decoded_response}")
+            return decoded_response
+        except Exception as e:
+            logging.error(f"An error occurred during the RPC call: {e}")
+            return None
+
+    async def _invoke(self, rpc_name, params):
+        """
+        Sends a single RPC request and reads the complete reply.
+
+        Unlike call_rpc, errors are raised to the caller instead of logged.
+
+        Returns:
+            bytes: The reply data, without its header or the end-of-transmission marker.
+
+        Raises:
+            VistARPCError: If the broker reports a security or application error.
+        """
+        parts = encode_rpc_message_parts(rpc_name, params)
+        sent = sum(len(part) for part in parts)
+        async with self._lock:
+            start_time = time.perf_counter()
+            try:
+                self.writer.writelines(parts)
+                await self.writer.drain()
+                response = await self._read_response(rpc_reply=True)
+            except BaseException as e:
+                self.metrics.record(rpc_name, time.perf_counter() - start_time, sent, error=True)
+                if not isinstance(e, VistARPCError):
+                    # The reply may still be on its way, e.g. when asyncio.wait_for cancelled the call.
+                    # Left unread, it would be taken for the reply to the next call.
+                    self._drop_connection()
+                raise
+        self.metrics.record(rpc_name, time.perf_counter() - start_time, sent, len(response))
+        return response
+
+    def _drop_connection(self):
+        """Closes the connection without waiting, so a half-read reply cannot be taken for another."""
+        if self.writer:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        self.connected = False
+        logging.warning("Connection dropped after an interrupted RPC call.")
+
+    async def _read_response(self, rpc_reply=False):
+        """
+        Reads one broker reply, up to the end-of-transmission marker.
+
+        Args:
+            rpc_reply (bool): Whether the reply starts with the security and
+                              application error segments sent for RPC calls.
+
+        Returns:
+            bytes: The reply, without its header or the end-of-transmission marker.
+
+        Raises:
+            ConnectionError: If the broker closes the connection mid-reply.
+            VistARPCError: If an RPC reply carries a security or application error,
+                           once the whole reply has been read.
+        """
+        header = bytearray()
+        response = bytearray()
+        try:
+            if rpc_reply:
+                # The segments' text may contain the end marker, so they are read by their length bytes.
+                for _ in range(2):
+                    header += await self.reader.readexactly(1)
+                    header += await self.reader.readexactly(header[-1])
+            while True:
+                try:
+                    response += await self.reader.readuntil(ET)
+                    del response[-1:]
+                    break
+                except asyncio.LimitOverrunError as e:
+                    # The reply is larger than the stream buffer; take what has arrived and keep going.
+                    response += await self.reader.readexactly(e.consumed)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError("Connection closed by the broker before the end of the reply.")
+        if rpc_reply:
+            _, error = parse_reply_header(header)
+            if error is not None:
+                raise VistARPCError(error)
+        return bytes(response)
+
+    async def disconnect(self):
+        """Disconnects from the VistA server."""
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.reader = None
+            self.writer = None
+            self.connected = False
+            logging.info("Disconnected from the server.")
+
+
+async def _main():
+    # --- Configuration ---
+    VISTA_HOST = 'localhost'
+    VISTA_PORT = 9297
+    ACCESS_CODE = 'gtmuser'
+    VERIFY_CODE = 'GT.M Rocks!'
+    CONTEXT = 'XWB BROKER EXAMPLE'
+
+    client = AsyncVistARPCClient(VISTA_HOST, VISTA_PORT, ACCESS_CODE, VERIFY_CODE, CONTEXT)
+    await client.connect()
+
+    if client.connected:
+        if await client.login():
+            await client.create_context()
+
+            response = await client.call_rpc("XWB LIST ALL RPCS")
+
+            if response:
+                print("\n--- RPC Result ---")
+                print(response)
+                print("--------------------")
+
+        await client.disconnect()
+
+if __name__ == "__main__":
+    asyncio.run(_main())
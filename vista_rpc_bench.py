@@ -0,0 +1,205 @@
+import argparse
+import json
+import logging
+import math
+import sys
+import time
+
+from vista_mock_broker import MockVistABroker
+from vista_rpc_client import VistARPCClient
+from vista_rpc_metrics import RPCMetricsRegistry
+from vista_rpc_pool import VistARPCPool
+
+ACCESS_CODE = 'DOCTOR1'
+VERIFY_CODE = 'DOCTOR1.'
+CONTEXT = 'OR CPRS GUI CHART'
+
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class _LatencyRecorder(RPCMetricsRegistry):
+    """A metrics registry that also keeps every call's latency, for exact percentiles."""
+
+    def __init__(self):
+        super().__init__()
+        self.latencies = []
+
+    def record(self, rpc_name, latency, bytes_sent=0, bytes_received=0, error=False):
+        super().record(rpc_name, latency, bytes_sent, bytes_received, error)
+        with self._lock:
+            self.latencies.append(latency)
+
+
+def summarize(latencies, calls, received, elapsed):
+    """
+    Builds the result record for one scenario.
+
+    latencies are per call in every scenario, and received is in bytes, so
+    results can be compared across scenarios and runs.
+    """
+    latencies = sorted(latencies)
+    return {
+        "calls": calls,
+        "elapsed_s": elapsed,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "calls_per_s": calls / elapsed if elapsed else 0.0,
+        "bytes_per_s": received / elapsed if elapsed else 0.0,
+    }
+
+
+def open_client(address):
+    client = VistARPCClient(address[0], address[1], ACCESS_CODE, VERIFY_CODE, CONTEXT)
+    client.connect()
+    if not client.connected or not client.login() or client.create_context() is None:
+        raise ConnectionError(f"Could not open a session on {address[0]}:{address[1]}")
+    return client
+
+
+def run_sequential(address, jobs, iterations):
+    """Times iterations rounds of jobs, one call at a time on a single connection."""
+    client = open_client(address)
+    latencies = []
+    received = 0
+    start = time.perf_counter()
+    try:
+        for _ in range(iterations):
+            for rpc_name, params in jobs:
+                call_start = time.perf_counter()
+                response = client.call_rpc(rpc_name, params)
+                latencies.append(time.perf_counter() - call_start)
+                if response is None:
+                    raise RuntimeError(f"{rpc_name} failed during the benchmark")
+                received += len(response.encode())
+    finally:
+        client.disconnect()
+    return summarize(latencies, len(latencies), received, time.perf_counter() - start)
+
+
+def run_fanout(address, jobs, iterations, connections):
+    """
+    Times iterations batches of jobs spread over several connections with call_many.
+
+    The connections come from a pool and are opened by an untimed warm-up
+    batch, so the timed batches measure the fan-out and not logging in.
+    Latencies are those of the individual calls, as in the other scenarios.
+    """
+    recorder = _LatencyRecorder()
+    pool = VistARPCPool(max_size=connections, metrics=recorder)
+    client = pool.checkout(address[0], address[1], ACCESS_CODE, VERIFY_CODE, CONTEXT)
+    received = 0
+    calls = 0
+    try:
+        client.call_many(jobs, connections=connections, pool=pool)
+        del recorder.latencies[:]
+        start = time.perf_counter()
+        for _ in range(iterations):
+            results = client.call_many(jobs, connections=connections, pool=pool)
+            for result in results:
+                if result.error is not None:
+                    raise RuntimeError(f"{result.rpc_name} failed during the benchmark: {result.error}")
+                received += len(result.response.encode())
+            calls += len(results)
+        elapsed = time.perf_counter() - start
+    finally:
+        pool.checkin(client)
+        pool.close()
+    return summarize(recorder.latencies, calls, received, elapsed)
+
+
+# name -> (broker settings, runner)
+SCENARIOS = {
+    "small_calls": (
+        {},
+        lambda address, iterations: run_sequential(
+            address, [("XWB IM HERE", []), ("ORWU USERINFO", [])], iterations * 50),
+    ),
+    "large_notes": (
+        {"note_lines": 20000},
+        lambda address, iterations: run_sequential(
+            address, [("TIU GET RECORD TEXT", [("literal", "100001001")])], iterations),
+    ),
+    "list_heavy": (
+        {"list_size": 5000},
+        lambda address, iterations: run_sequential(
+            address, [("XWB LIST ALL RPCS", []), ("ORQPT PROVIDER PATIENTS", [("literal", "1")])], iterations * 5),
+    ),
+    "fanout": (
+        {"latency": 0.005},
+        lambda address, iterations: run_fanout(
+            address, [("ORQQAL LIST", [("literal", str(100001 + i))]) for i in range(200)], iterations, 8),
+    ),
+}
+
+
+def run_benchmarks(names, iterations):
+    """Runs the named scenarios, each against its own mock broker."""
+    results = {}
+    for name in names:
+        broker_settings, runner = SCENARIOS[name]
+        with MockVistABroker(**broker_settings) as broker:
+            results[name] = runner(broker.address, iterations)
+        print(f"{name:12s} p50 {results[name]['p50_ms']:9.3f} ms  p95 {results[name]['p95_ms']:9.3f} ms  "
+              f"p99 {results[name]['p99_ms']:9.3f} ms  {results[name]['calls_per_s']:10.1f} calls/s  "
+              f"{results[name]['bytes_per_s'] / 1e6:9.2f} MB/s")
+    return results
+
+
+def find_regressions(results, baseline, threshold):
+    """
+    Compares results against a baseline run.
+
+    A scenario regresses if its p95 latency grew, or its throughput shrank,
+    by more than threshold (a fraction, e.g. 0.1 for 10%).
+
+    Returns:
+        list: A description of each regression found.
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if before["p95_ms"] and result["p95_ms"] > before["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {before['p95_ms']:.3f} ms -> {result['p95_ms']:.3f} ms")
+        if result["calls_per_s"] < before["calls_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: {before['calls_per_s']:.1f} -> {result['calls_per_s']:.1f} calls/s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark VistARPCClient against a mock VistA RPC Broker.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--output", default="bench_results.json", help="File the results are written to.")
+    parser.add_argument("--baseline", help="Results file from an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown as a fraction before a scenario counts as a regression.")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = run_benchmarks(args.scenarios, args.iterations)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = find_regressions(results, baseline, args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against the baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,261 @@
+import threading
+import time
+from collections import OrderedDict
+
+from vista_rpc_client import CANCEL_POLL_INTERVAL, RPCCancelledError, RPCTimeoutError, encode_rpc_param
+
+# Read-only RPCs that are safe to cache, with how long (in seconds) a reply stays fresh.
+# RPCs not listed here are never cached.
+DEFAULT_TTLS = {
+    "ORWU USERINFO": 3600,
+    "TIU LONG LIST OF TITLES": 3600,
+    "XWB LIST ALL RPCS": 3600,
+    "ORQPT PROVIDER PATIENTS": 300,
+    "ORQQAL LIST": 300,
+    "ORQQPL PROBLEM LIST": 300,
+    "ORQQVI VITALS": 120,
+    "TIU DOCUMENTS BY CONTEXT": 120,
+    "TIU SUMMARIES": 120,
+    "TIU GET RECORD TEXT": 120,
+    "ORWORB FASTUSER": 60,
+}
+
+_NOTE_READS = ["TIU DOCUMENTS BY CONTEXT", "TIU SUMMARIES", "TIU GET RECORD TEXT"]
+_PROBLEM_READS = ["ORQQPL PROBLEM LIST"]
+_ALERT_READS = ["ORWORB FASTUSER"]
+
+# Write RPCs and the cached RPCs whose replies they can make stale.
+DEFAULT_INVALIDATIONS = {
+    "TIU CREATE RECORD": _NOTE_READS,
+    "TIU UPDATE RECORD": _NOTE_READS,
+    "TIU SET DOCUMENT TEXT": _NOTE_READS,
+    "TIU SIGN RECORD": _NOTE_READS + _ALERT_READS,
+    "TIU DELETE RECORD": _NOTE_READS,
+    "ORQQPL ADD SAVE": _PROBLEM_READS,
+    "ORQQPL EDIT SAVE": _PROBLEM_READS,
+    "ORQQPL DELETE": _PROBLEM_READS,
+    "ORQQPL UPDATE": _PROBLEM_READS,
+    "ORWDAL32 SAVE ALLERGY": ["ORQQAL LIST"],
+    "ORB DELETE ALERT": _ALERT_READS,
+    "ORB FORWARD ALERT": _ALERT_READS,
+    "ORB RENEW ALERT": _ALERT_READS,
+}
+
+
+class RPCResponseCache:
+    """
+    A read-through cache of RPC replies with per-RPC TTLs and an LRU size bound.
+
+    Entries are keyed by RPC name, encoded parameters and the patient selected
+    on the connection, since several RPCs answer for the selected patient, and
+    by the broker, user and context of the session, since replies such as
+    ORWU USERINFO differ between users. A cache can therefore be shared by the
+    sessions of several users, e.g. across a VistARPCPool, without one user's
+    replies being served to another.
+    """
+
+    def __init__(self, max_entries=1024, ttls=None, invalidations=None):
+        """
+        Initializes the RPCResponseCache.
+
+        Args:
+            max_entries (int): The maximum number of cached replies; the least
+                               recently used are dropped first.
+            ttls (dict, optional): RPC name -> seconds a reply stays fresh.
+                                   Defaults to DEFAULT_TTLS.
+            invalidations (dict, optional): Write RPC name -> list of cached RPC names
+                                            it evicts. Defaults to DEFAULT_INVALIDATIONS.
+        """
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.invalidations = dict(DEFAULT_INVALIDATIONS if invalidations is None else invalidations)
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (expires_at, response)
+        self._lock = threading.Lock()
+
+    def is_cacheable(self, rpc_name):
+        """Returns True if replies to rpc_name may be cached."""
+        return rpc_name in self.ttls
+
+    @staticmethod
+    def make_key(client, rpc_name, params):
+        """Builds the cache key for a call on client."""
+        encoded = b''.join(encode_rpc_param(param_type, value) for param_type, value in params or [])
+        return (rpc_name, encoded, client.selected_dfn, client.host, client.port, client.access_code, client.context)
+
+    def get(self, key):
+        """
+        Looks up a cached reply.
+
+        Returns:
+            bytes: The cached reply, or None if it is missing or expired.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, response = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return response
+
+    def put(self, key, response):
+        """Stores a reply if its RPC is cacheable."""
+        ttl = self.ttls.get(key[0])
+        if ttl is None:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_for(self, rpc_name):
+        """
+        Evicts the replies a call to rpc_name may have made stale.
+
+        Returns:
+            int: The number of entries evicted.
+        """
+        affected = self.invalidations.get(rpc_name)
+        if not affected:
+            return 0
+        return self.invalidate(affected)
+
+    def invalidate(self, rpc_names=None):
+        """
+        Evicts every cached reply for the given RPC names, or everything if None.
+
+        Returns:
+            int: The number of entries evicted.
+        """
+        with self._lock:
+            if rpc_names is None:
+                count = len(self._entries)
+                self._entries.clear()
+                return count
+            rpc_names = set(rpc_names)
+            stale = [key for key in self._entries if key[0] in rpc_names]
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class _Flight:
+    """One call in progress, and the outcome its followers wait for."""
+
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlightGroup:
+    """
+    Coalesces identical read-only calls that are in flight at the same time.
+
+    The first caller for a key makes the call; callers that ask for the same
+    key before it finishes wait for it and receive the same reply, or the
+    same error, instead of sending their own request. Nothing is kept once
+    the call finishes; combine with RPCResponseCache to reuse replies later.
+
+    A group can be shared by several clients or a pool. Keys include the
+    broker, user and context, so only calls that would get the same reply
+    are coalesced.
+    """
+
+    def __init__(self, rpc_names=None):
+        """
+        Initializes the SingleFlightGroup.
+
+        Args:
+            rpc_names (set, optional): The RPCs whose calls may be coalesced.
+                                       Defaults to the read-only RPCs in DEFAULT_TTLS.
+        """
+        self.rpc_names = frozenset(DEFAULT_TTLS if rpc_names is None else rpc_names)
+        # Calls answered by a round trip made for another caller.
+        self.shared = 0
+        self._flights = {}  # key -> _Flight
+        self._lock = threading.Lock()
+
+    def is_coalescable(self, rpc_name):
+        """Returns True if calls to rpc_name may be coalesced."""
+        return rpc_name in self.rpc_names
+
+    @staticmethod
+    def make_key(client, rpc_name, params):
+        """Builds the key identical calls on client share."""
+        return RPCResponseCache.make_key(client, rpc_name, params)
+
+    def do(self, key, call, timeout=None, cancel_event=None):
+        """
+        Runs call(), or waits for the identical call already in flight.
+
+        Args:
+            key: The key from make_key.
+            call (callable): Makes the call and returns its reply.
+            timeout (float, optional): Seconds a follower waits for the shared reply.
+            cancel_event (threading.Event, optional): Setting this event stops a follower waiting.
+
+        Returns:
+            The reply returned by call, possibly the one made for another caller.
+
+        Raises:
+            The error the shared call raised, or RPCTimeoutError or RPCCancelledError
+            if a follower gave up waiting. A follower whose leader was cancelled or
+            timed out makes the call itself instead of sharing that error.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                else:
+                    self.shared += 1
+
+            if leader:
+                try:
+                    flight.response = call()
+                except BaseException as e:
+                    flight.error = e
+                    raise
+                finally:
+                    with self._lock:
+                        del self._flights[key]
+                    flight.done.set()
+                return flight.response
+
+            self._wait(flight, deadline, cancel_event)
+            if isinstance(flight.error, (RPCCancelledError, RPCTimeoutError)):
+                # The leader gave up or ran out of its own time, which says nothing about
+                # this caller's deadline; make the call again, within what is left of it.
+                continue
+            if flight.error is not None:
+                raise flight.error
+            return flight.response
+
+    @staticmethod
+    def _wait(flight, deadline, cancel_event):
+        while True:
+            wait = None if deadline is None else deadline - time.monotonic()
+            if wait is not None and wait <= 0:
+                raise RPCTimeoutError("The RPC call did not complete before its deadline.")
+            if cancel_event is not None:
+                if cancel_event.is_set():
+                    raise RPCCancelledError("The RPC call was cancelled.")
+                wait = CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL)
+            if flight.done.wait(wait):
+                return
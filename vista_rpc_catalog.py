@@ -0,0 +1,237 @@
+import logging
+import os
+import pickle
+
+# Bump when the layout of the pickled catalog changes, so old caches are rebuilt.
+CACHE_VERSION = 1
+
+# Substring search indexes names and details by their 3-character grams.
+GRAM_SIZE = 3
+
+DEFAULT_INFO = {
+    "category": "",
+    "parameters": "No specific parameters found in rpc_details.txt.",
+    "description": "No specific description found in rpc_details.txt.",
+}
+
+
+def parse_rpc_details(text):
+    """
+    Parses rpc_details.txt.
+
+    The file lists RPCs by category: a "<Category> RPCs:" line, optionally
+    "<Category> (None found) RPCs:", followed by "* NAME: parameters" or
+    "* NAME" lines.
+
+    Returns:
+        dict: RPC name -> {"category", "parameters", "description"}.
+    """
+    info = {}
+    current_category = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.endswith("RPCs:"):
+            current_category = line[:-5].strip()
+            if current_category.endswith(" (None found)"):
+                current_category = current_category[:-13]
+            continue
+        if line.startswith("*"):
+            rpc_entry = line[1:].strip()
+            if ":" in rpc_entry:
+                rpc_name, params_str = rpc_entry.split(":", 1)
+                params_str = params_str.strip()
+                info[rpc_name.strip()] = {
+                    "category": current_category,
+                    "parameters": params_str,
+                    "description": params_str,  # The file has no separate descriptions.
+                }
+            else:
+                info[rpc_entry] = {
+                    "category": current_category,
+                    "parameters": "No parameters found.",
+                    "description": "No parameters found.",
+                }
+    return info
+
+
+class RPCCatalog:
+    """
+    The RPC names a broker offers, with their details, indexed for search as you type.
+
+    A prefix trie answers prefix queries by walking the query's characters;
+    since names are kept sorted, the names below a trie node are a contiguous
+    range, so each node only stores where that range starts and ends. A
+    3-gram index narrows substring queries over names and details to the few
+    entries that contain all of the query's grams before they are checked.
+    Matching is case-insensitive.
+    """
+
+    def __init__(self, names, info=None):
+        """
+        Initializes the RPCCatalog.
+
+        Args:
+            names (iterable): The RPC names.
+            info (dict, optional): RPC name -> details, as parse_rpc_details returns.
+        """
+        self.names = sorted(set(names) | set(info or ()), key=str.upper)
+        self._info = dict(info or {})
+        self._keys = [name.upper() for name in self.names]
+        self._details = [" ".join(self._info.get(name, {}).values()).upper() for name in self.names]
+
+        # Each node is [children, first index, last index + 1]; plain lists keep the cache quick to load.
+        self._trie = [{}, 0, len(self._keys)]
+        for index, key in enumerate(self._keys):
+            node = self._trie
+            for char in key:
+                child = node[0].get(char)
+                if child is None:
+                    child = node[0][char] = [{}, index, index]
+                child[2] = index + 1
+                node = child
+
+        self._name_grams = self._index_grams(self._keys)
+        self._detail_grams = self._index_grams(self._details)
+
+    @staticmethod
+    def _index_grams(texts):
+        grams = {}
+        for index, text in enumerate(texts):
+            for gram in {text[i:i + GRAM_SIZE] for i in range(len(text) - GRAM_SIZE + 1)}:
+                grams.setdefault(gram, []).append(index)
+        return grams
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._info or name in self.names
+
+    def info(self, name):
+        """Returns the details of an RPC, with placeholders for anything rpc_details.txt lacks."""
+        return self._info.get(name, DEFAULT_INFO)
+
+    def _prefix_range(self, query):
+        node = self._trie
+        for char in query:
+            node = node[0].get(char)
+            if node is None:
+                return range(0)
+        return range(node[1], node[2])
+
+    def prefix(self, query):
+        """Returns the names starting with query, in order."""
+        return [self.names[index] for index in self._prefix_range(query.upper())]
+
+    def search(self, query, limit=None, details=True):
+        """
+        Finds RPCs matching query.
+
+        Names starting with the query come first, then names containing it,
+        then, if details is True, RPCs whose details contain it.
+
+        Args:
+            query (str): The text typed so far.
+            limit (int, optional): The maximum number of names to return.
+            details (bool): Also search the RPCs' categories and parameters.
+
+        Returns:
+            list: Matching RPC names.
+        """
+        query = query.strip().upper()
+        if not query:
+            return self.names[:limit]
+
+        matches = self._prefix_range(query)
+        seen = set(matches)
+        results = self.names[matches.start:matches.stop]
+
+        sources = [(self._keys, self._name_grams)]
+        if details:
+            sources.append((self._details, self._detail_grams))
+        for texts, grams in sources:
+            if limit is not None and len(results) >= limit:
+                break
+            for index in self._substring_ids(query, texts, grams):
+                if index not in seen:
+                    seen.add(index)
+                    results.append(self.names[index])
+        return results[:limit]
+
+    @staticmethod
+    def _substring_ids(query, texts, grams):
+        if len(query) < GRAM_SIZE:
+            candidates = range(len(texts))
+        else:
+            postings = []
+            for i in range(len(query) - GRAM_SIZE + 1):
+                ids = grams.get(query[i:i + GRAM_SIZE])
+                if ids is None:
+                    return []
+                postings.append(ids)
+            postings.sort(key=len)
+            candidates = set(postings[0]).intersection(*postings[1:])
+            candidates = sorted(candidates)
+        return [index for index in candidates if query in texts[index]]
+
+
+def _source_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def load_catalog(rpc_list_path, details_path=None, cache_path=None):
+    """
+    Loads the RPC catalog, from its cache if neither source file has changed.
+
+    The parsed and indexed catalog is pickled to cache_path. The cache is used
+    as long as the modification times and sizes of the source files match
+    those recorded in it, and is rebuilt otherwise.
+
+    Args:
+        rpc_list_path (str): cprs_rpc_list.txt, one RPC name per line.
+        details_path (str, optional): rpc_details.txt.
+        cache_path (str, optional): Where the cache is kept. Defaults to the RPC
+                                    list's path with a .catalog.pickle extension.
+
+    Returns:
+        RPCCatalog: The catalog. It is empty if the RPC list cannot be read.
+    """
+    if cache_path is None:
+        cache_path = os.path.splitext(rpc_list_path)[0] + ".catalog.pickle"
+    stamp = (CACHE_VERSION, _source_stamp(rpc_list_path), details_path and _source_stamp(details_path))
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_stamp, catalog = pickle.load(f)
+        if cached_stamp == stamp:
+            return catalog
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ValueError):
+        pass
+
+    names = []
+    try:
+        with open(rpc_list_path, 'r') as f:
+            names = [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        logging.warning(f"RPC list file not found: {rpc_list_path}")
+    info = {}
+    if details_path:
+        try:
+            with open(details_path, 'r') as f:
+                info = parse_rpc_details(f.read())
+        except FileNotFoundError:
+            logging.warning(f"rpc_details.txt not found: {details_path}. RPC descriptions will be limited.")
+
+    catalog = RPCCatalog(names, info)
+    try:
+        with open(cache_path, 'wb') as f:
+            pickle.dump((stamp, catalog), f, protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError as e:
+        logging.warning(f"Could not write the RPC catalog cache {cache_path}: {e}")
+    return catalog
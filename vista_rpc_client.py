@@ -1,5 +1,14 @@
+import queue
+import random
 import socket
 import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from vista_rpc_metrics import default_registry
+from vista_rpc_response import RPCResponse
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -10,10 +19,267 @@ GS = b'\x1d'  # Group Separator (ASCII 29)
 RS = b'\x1e'  # Record Separator (ASCII 30)
 ET = b'\x04'  # End of Transmission (ASCII 4)
 
+# The handshake and login messages are a simplified sign-on that only
+# vista_mock_broker understands. A real broker expects TCPConnect followed by
+# the XUS SIGNON SETUP and XUS AV CODE RPCs, with the access and verify codes
+# encrypted with the Kernel cipher, none of which this client implements.
+# Against a real broker, sign on with vavista.rpc.connect instead.
+SIGNON_PREFIX = b'[XWB]10304\r\n'
+
+# Size of the reusable receive buffer. A larger reply grows the buffer while
+# it is read, and the buffer is put back to this size afterwards.
+RECV_BUFFER_SIZE = 64 * 1024
+
+# The outcome of one job passed to VistARPCClient.call_many. Exactly one of
+# response and error is set.
+RPCResult = namedtuple("RPCResult", ["rpc_name", "response", "error"])
+
+# The broker's "I'm here" RPC, used to keep idle sessions alive.
+HEARTBEAT_RPC = "XWB IM HERE"
+
+# RPCs that only read, so sending one twice is harmless: a call whose reply was
+# lost with the connection is resent after reconnecting, and a slow call may
+# be hedged (see VistARPCPool.call_rpc).
+DEFAULT_IDEMPOTENT_RPCS = frozenset({
+    "XWB IM HERE",
+    "XWB LIST ALL RPCS",
+    "ORWU USERINFO",
+    "ORWPT LIST ALL",
+    "ORWPT ID INFO",
+    "ORQPT PROVIDER PATIENTS",
+    "ORQQAL LIST",
+    "ORQQPL LIST",
+    "ORQQPL PROBLEM LIST",
+    "ORQQVI VITALS",
+    "ORWLRR INTERIMG",
+    "ORWORB FASTUSER",
+    "TIU LONG LIST OF TITLES",
+    "TIU DOCUMENTS BY CONTEXT",
+    "TIU SUMMARIES",
+    "TIU GET RECORD TEXT",
+})
+
+# How often, in seconds, a blocked call wakes up to check its cancel event.
+CANCEL_POLL_INTERVAL = 0.1
+
+class VistARPCError(Exception):
+    """Raised when the broker answers an RPC with a security or application error."""
+
+
+class RPCTimeoutError(TimeoutError):
+    """Raised when an RPC call does not complete before its deadline."""
+
+
+class RPCCancelledError(Exception):
+    """Raised when an RPC call is cancelled through its cancel event."""
+
+
+class RPCStreamingError(RuntimeError):
+    """
+    Raised when a thread makes a call on a client while it is still reading
+    a reply from iter_rpc_records on that client.
+    """
+
+
+class BrokerDisconnectedError(ConnectionError):
+    """
+    Raised when the connection turns out to be closed before a request was
+    sent, so the request can safely be sent again.
+    """
+
+
+class ReplyLostError(ConnectionError):
+    """
+    Raised when the connection is lost after a request was sent and before
+    the broker replied. The broker may have acted on the request, so only
+    idempotent RPCs are sent again.
+    """
+
+
+class XWBEncoder:
+    """
+    Encodes RPC requests in the length-prefixed XWB (NS mode) broker format.
+
+    A request is laid out as
+
+        [XWB]1130 2 \\x01 1 <len><rpc name> 5 <params> \\x04
+
+    where each literal is '0' + LPack(value) + 'f', each reference is
+    '1' + LPack(value) + 'f', and a list is '2' followed by LPack(subscript) +
+    LPack(value) pairs joined by 't' and closed by 'f'. LPack prefixes a value
+    with its byte length as a zero-padded decimal whose width is declared in
+    the message header. A call with no parameters sends '4f'.
+
+    Everything up to the parameters depends only on the RPC name, so it is
+    cached per name. Parameters are written into a single bytearray, which
+    keeps large list parameters linear in their size.
+    """
+
+    # Length width used unless a value is too long for it.
+    LENGTH_WIDTH = 3
+
+    def __init__(self):
+        self._headers = {}
+
+    def encode_parts(self, rpc_name, params):
+        """
+        Encodes a request as separate buffers, ready for a scatter-gather send.
+
+        Args:
+            rpc_name (str): The name of the RPC to call.
+            params (list): A list of (param_type, value) tuples.
+
+        Returns:
+            list: The cached header, the encoded parameters and the end marker.
+        """
+        params = [(param_type, self._as_bytes_param(param_type, value)) for param_type, value in params]
+        width = self._length_width(params)
+        body = bytearray()
+        if not params:
+            body += b'4f'
+        for param_type, value in params:
+            self._write_param(body, param_type, value, width)
+        return [self._header(rpc_name, width), body, ET]
+
+    def encode(self, rpc_name, params):
+        """Encodes a request as one bytes object."""
+        return b''.join(self.encode_parts(rpc_name, params))
+
+    def encode_param(self, param_type, value):
+        """Encodes a single parameter with the default length width."""
+        body = bytearray()
+        self._write_param(body, param_type, self._as_bytes_param(param_type, value), self.LENGTH_WIDTH)
+        return bytes(body)
+
+    def _header(self, rpc_name, width):
+        key = (rpc_name, width)
+        header = self._headers.get(key)
+        if header is None:
+            name = rpc_name.encode()
+            if len(name) > 255:
+                raise ValueError(f"RPC name is too long: {rpc_name}")
+            header = b'[XWB]11' + str(width).encode() + b'02\x011' + bytes([len(name)]) + name + b'5'
+            self._headers[key] = header
+        return header
+
+    @staticmethod
+    def _as_bytes_param(param_type, value):
+        """Converts a parameter value to bytes, or a list of (bytes, bytes) pairs for lists."""
+        if param_type in ('literal', 'reference'):
+            return str(value).encode()
+        elif param_type == 'list':
+            items = value.items() if isinstance(value, dict) else value
+            return [(str(sub).encode(), str(val).encode()) for sub, val in items]
+        else:
+            raise ValueError(f"Unknown parameter type: {param_type}")
+
+    def _length_width(self, params):
+        longest = 0
+        for param_type, value in params:
+            if param_type == 'list':
+                for sub, val in value:
+                    longest = max(longest, len(sub), len(val))
+            else:
+                longest = max(longest, len(value))
+        return max(self.LENGTH_WIDTH, len(str(longest)))
+
+    @staticmethod
+    def _write_param(body, param_type, value, width):
+        if param_type == 'list':
+            body += b'2'
+            if not value:
+                value = [(b'', b'')]
+            for index, (sub, val) in enumerate(value):
+                if index:
+                    body += b't'
+                body += str(len(sub)).zfill(width).encode()
+                body += sub
+                body += str(len(val)).zfill(width).encode()
+                body += val
+        else:
+            body += b'0' if param_type == 'literal' else b'1'
+            body += str(len(value)).zfill(width).encode()
+            body += value
+        body += b'f'
+
+
+_encoder = XWBEncoder()
+
+def encode_rpc_param(param_type, value):
+    """
+    Encodes a single RPC parameter.
+
+    Args:
+        param_type (str): The type of the parameter (e.g., 'literal', 'reference', 'list').
+        value: The value of the parameter.
+
+    Returns:
+        bytes: The encoded RPC parameter.
+    """
+    return _encoder.encode_param(param_type, value)
+
+def encode_rpc_message_parts(rpc_name, params):
+    """
+    Encodes an RPC request as a list of buffers for a scatter-gather send.
+
+    Args:
+        rpc_name (str): The name of the RPC to call.
+        params (list): A list of (param_type, value) tuples.
+
+    Returns:
+        list: Buffers that together form the message.
+    """
+    return _encoder.encode_parts(rpc_name, params)
+
+def build_rpc_message(rpc_name, params):
+    """
+    Builds the complete request message for an RPC call.
+
+    Args:
+        rpc_name (str): The name of the RPC to call.
+        params (list): A list of (param_type, value) tuples.
+
+    Returns:
+        bytes: The message, terminated by the end-of-transmission marker.
+    """
+    return _encoder.encode(rpc_name, params)
+
+def parse_reply_header(reply):
+    """
+    Parses the security and application error segments at the start of a reply.
+
+    Each segment is a length byte followed by that many bytes of message text;
+    a zero byte means the segment is empty. The text may contain any byte,
+    including the end-of-transmission marker, so a reader must only look for
+    the marker after the header.
+
+    Args:
+        reply (bytes): The reply, or at least its beginning.
+
+    Returns:
+        tuple: (header length, error) where error is the message of the first
+               non-empty segment, or None. None if more bytes are needed to tell.
+    """
+    offset = 0
+    error = None
+    for segment in ("Security error", "Application error"):
+        if len(reply) <= offset:
+            return None
+        length = reply[offset]
+        if len(reply) < offset + 1 + length:
+            return None
+        if length and error is None:
+            message = bytes(reply[offset + 1:offset + 1 + length]).decode(errors='replace')
+            error = f"{segment}: {message}"
+        offset += 1 + length
+    return offset, error
+
 class VistARPCClient:
     """A client for making RPC calls to a VistA server."""
 
-    def __init__(self, host, port, access_code, verify_code, context):
+    def __init__(self, host, port, access_code, verify_code, context, cache=None, metrics=None,
+                 log_bodies=False, body_log_sample_rate=1.0, auto_reconnect=True, timeout=None,
+                 single_flight=None, idempotent_rpcs=DEFAULT_IDEMPOTENT_RPCS):
         """
         Initializes the VistARPCClient.
 
@@ -23,23 +289,71 @@ class VistARPCClient:
             access_code (str): The user's access code for authentication.
             verify_code (str): The user's verify code for authentication.
             context (str): The application context for the RPC calls.
+            cache (RPCResponseCache, optional): A cache for replies to read-only RPCs.
+            metrics (RPCMetricsRegistry, optional): Where per-RPC metrics are recorded.
+                                                    Defaults to vista_rpc_metrics.default_registry.
+            log_bodies (bool): Log the full text of RPC replies. Replies can be large
+                               and contain PHI, so this is off by default.
+            body_log_sample_rate (float): The fraction of replies logged when log_bodies is on.
+            auto_reconnect (bool): Reconnect, log in again and resend a call when the
+                                   broker is found to have dropped the connection.
+                                   A call that was already sent is only resent if its
+                                   RPC is in idempotent_rpcs.
+            timeout (float, optional): The default deadline, in seconds, for connecting and
+                                       for each RPC call. None waits forever.
+            single_flight (SingleFlightGroup, optional): Coalesces identical read-only calls
+                                                         made at the same time, on this client
+                                                         or on others sharing the group.
+            idempotent_rpcs (set): RPCs that are safe to send twice.
         """
         self.host = host
         self.port = port
         self.access_code = access_code
         self.verify_code = verify_code
         self.context = context
+        self.cache = cache
+        self.metrics = default_registry if metrics is None else metrics
+        self.log_bodies = log_bodies
+        self.body_log_sample_rate = body_log_sample_rate
+        self.auto_reconnect = auto_reconnect
+        self.timeout = timeout
+        self.single_flight = single_flight
+        self.idempotent_rpcs = frozenset(idempotent_rpcs)
+        self.selected_dfn = None
         self.socket = None
         self.connected = False
+        self._recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        # Serializes use of the socket between callers and the heartbeat thread.
+        self._lock = threading.RLock()
+        self._last_activity = time.monotonic()
+        self._reconnecting = False
+        # Set when a timed out or cancelled call had to drop the connection.
+        self._dropped = False
+        self._heartbeat_thread = None
+        self._heartbeat_stop = threading.Event()
+        # Deadline and cancel event of the call in progress, see _call_scope.
+        self._deadline = None
+        self._cancel_event = None
+        # The thread iterating over a reply from iter_rpc_records, while it does.
+        self._streaming_thread = None
+        # Per thread: whether its last _execute sent a request, see sent_request.
+        self._local = threading.local()
 
     def connect(self):
         """Establishes a connection to the VistA server."""
         try:
+            # When reconnecting for a call, connecting must fit in what is left of the call's deadline.
+            timeout = self._time_left(self.timeout)
+            if timeout is not None and timeout <= 0:
+                raise RPCTimeoutError("No time left before the call's deadline to connect.")
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
             self.socket.connect((self.host, self.port))
             self.connected = True
+            self._dropped = False
             logging.info(f"Successfully connected to {self.host}:{self.port}")
-            self._perform_handshake()
+            with self._call_scope(self.timeout, None):
+                self._perform_handshake()
         except ConnectionRefusedError:
             logging.error(f"Connection refused. Is the VistA RPC Broker running on {self.host}:{self.port}?")
             self.connected = False
@@ -48,40 +362,47 @@ class VistARPCClient:
             self.connected = False
 
     def _perform_handshake(self):
-        """Performs the initial handshake with the VistA RPC Broker."""
-        handshake_message = b'[XWB]10304\r\n'
-        self.socket.sendall(handshake_message)
-        response = self.socket.recv(4096)
+        """Performs the initial handshake, in the mock broker's simplified sign-on (see SIGNON_PREFIX)."""
+        handshake_message = SIGNON_PREFIX
+        self._send_parts([handshake_message])
+        response = self._read_response()
         logging.info(f"Handshake response: {response.decode().strip()}")
 
     def login(self):
-        """Logs in to the VistA server using the provided credentials."""
+        """Logs in with the provided credentials, in the mock broker's simplified sign-on (see SIGNON_PREFIX)."""
         if not self.connected:
             logging.error("Cannot log in without a connection.")
             return
 
-        login_message = f"[XWB]10304\r\n{self.access_code};{self.verify_code}\r\n".encode()
-        self.socket.sendall(login_message)
-        response = self.socket.recv(4096)
+        login_message = SIGNON_PREFIX + f"{self.access_code};{self.verify_code}\r\n".encode()
+        self._check_not_streaming()
+        with self._lock, self._call_scope(self.timeout, None):
+            self._send_parts([login_message])
+            response = self._read_response()
         logging.info(f"Login response: {response.decode().strip()}")
 
         if not response.startswith(b'\x01'):
             logging.error("Login failed. Please check your access and verify codes.")
-            self.disconnect()
+            self._close_socket()
             return False
         
         logging.info("Login successful.")
         return True
 
     def create_context(self):
-        """Creates the application context for making RPC calls."""
+        """
+        Creates the application context for making RPC calls.
+
+        Returns:
+            str: The broker's reply, or None if the context could not be created.
+        """
         if not self.connected:
             logging.error("Cannot create context without a connection.")
             return
 
-        self.call_rpc("XWB CREATE CONTEXT", [("literal", self.context)])
+        return self.call_rpc("XWB CREATE CONTEXT", [("literal", self.context)])
 
-    def call_rpc(self, rpc_name, params=None):
+    def call_rpc(self, rpc_name, params=None, timeout=None, cancel_event=None):
         """
         Makes an RPC call to the VistA server.
 
@@ -89,11 +410,14 @@ class VistARPCClient:
             rpc_name (str): The name of the RPC to call.
             params (list, optional): A list of tuples, where each tuple represents a parameter
                                      in the format (param_type, value). Defaults to None.
+            timeout (float, optional): Seconds the call may take. Defaults to the client's timeout.
+            cancel_event (threading.Event, optional): Setting this event from another
+                                                      thread abandons the call.
 
         Returns:
             str: The response from the RPC call, or None if an error occurs.
         """
-        if not self.connected:
+        if not self.connected and not (self._dropped and self.auto_reconnect):
             logging.error("Cannot make an RPC call without a connection.")
             return None
 
@@ -101,28 +425,689 @@ class VistARPCClient:
             params = []
 
         try:
-            rpc_message_parts = [
-                b'[XWB]10304',
-                b'\r\n',
-                rpc_name.encode(),
-                b'\r\n'
-            ]
-
-            for param_type, value in params:
-                rpc_message_parts.append(self._encode_rpc_param(param_type, value))
-
-            rpc_message_parts.append(ET)
-            final_rpc_message = b''.join(rpc_message_parts)
-
-            self.socket.sendall(final_rpc_message)
-            response = self.socket.recv(4096)
+            response = self._execute(rpc_name, params, timeout, cancel_event)
             decoded_response = response.decode().strip()
-            logging.info(f"RPC response for '{rpc_name}': {decoded_response}")
+            if self.log_bodies and random.random() < self.body_log_sample_rate:
+                logging.info(f"RPC response for '{rpc_name}': {decoded_response}")
             return decoded_response
+        except RPCStreamingError:
+            raise
         except Exception as e:
             logging.error(f"An error occurred during the RPC call: {e}")
             return None
 
+    def call_rpc_response(self, rpc_name, params=None, delimiter='^', timeout=None, cancel_event=None):
+        """
+        Makes an RPC call and returns the reply undecoded, as an RPCResponse.
+
+        Unlike call_rpc, the reply is not decoded as a whole: records and their
+        fields are located in the reply bytes and decoded only as they are read,
+        which keeps large list replies cheap when only some fields are needed.
+
+        Args:
+            rpc_name (str): The name of the RPC to call.
+            params (list, optional): Parameters as for call_rpc.
+            delimiter (str): The field separator within a record.
+            timeout (float, optional): Seconds the call may take. Defaults to the client's timeout.
+            cancel_event (threading.Event, optional): Setting this event abandons the call.
+
+        Returns:
+            RPCResponse: The reply.
+
+        Raises:
+            ConnectionError: If there is no connection or it is lost.
+            VistARPCError: If the broker answers with an error.
+        """
+        if not self.connected and not (self._dropped and self.auto_reconnect):
+            raise ConnectionError("Cannot make an RPC call without a connection.")
+
+        response = RPCResponse(self._execute(rpc_name, params or [], timeout, cancel_event), rpc_name, delimiter)
+        if self.log_bodies and random.random() < self.body_log_sample_rate:
+            logging.info(f"RPC response for '{rpc_name}': {response.text}")
+        return response
+
+    def iter_rpc_records(self, rpc_name, params=None, delimiter='^', timeout=None, cancel_event=None):
+        """
+        Makes an RPC call and yields the reply one record at a time as it arrives.
+
+        Meant for list RPCs such as ORWPT LIST ALL or XWB LIST ALL RPCS, whose
+        replies are lines of caret-delimited fields. Records are parsed as soon
+        as their line has been received, so only the current line is held in
+        memory. Blank lines are skipped. If the generator is closed early, the
+        rest of the reply is read and discarded so the connection stays usable.
+
+        Args:
+            rpc_name (str): The name of the RPC to call.
+            params (list, optional): Parameters as for call_rpc.
+            delimiter (str): The field separator within a record.
+            timeout (float, optional): Seconds the whole reply may take, including the time
+                                       spent consuming records. Defaults to the client's timeout.
+            cancel_event (threading.Event, optional): Setting this event abandons the call.
+
+        Yields:
+            list: The fields of one record, as strings.
+
+        The connection carries nothing else until the reply has been read, so
+        the loop over the records must not make calls on this client; such a
+        call raises RPCStreamingError. Other threads' calls wait their turn.
+
+        Raises:
+            ConnectionError: If there is no connection or it is lost mid-reply.
+            RPCStreamingError: If called while this thread is iterating over another reply.
+        """
+        self._check_not_streaming()
+        # Encoded before the lock is taken, so a bad parameter cannot leave the client locked.
+        parts = encode_rpc_message_parts(rpc_name, params or [])
+        timeout = self.timeout if timeout is None else timeout
+        if not self.connected and self._dropped and self.auto_reconnect:
+            with self._lock, self._call_scope(timeout, cancel_event):
+                self.reconnect()
+        if not self.connected:
+            raise ConnectionError("Cannot make an RPC call without a connection.")
+
+        self._lock.acquire()
+        self._streaming_thread = threading.current_thread()
+        scope = self._call_scope(timeout, cancel_event)
+        scope.__enter__()
+        start_time = time.perf_counter()
+        pending = bytearray()
+        received = 0
+        chunks = None
+        failed = False
+        try:
+            self._send_parts(parts)
+            chunks = self._iter_response_chunks(rpc_reply=True)
+            for chunk in chunks:
+                received += len(chunk)
+                pending += chunk
+                start = 0
+                while True:
+                    end = pending.find(b'\r\n', start)
+                    if end == -1:
+                        break
+                    line = pending[start:end]
+                    start = end + 2
+                    if line.strip():
+                        yield line.decode().split(delimiter)
+                del pending[:start]
+            if pending.strip():
+                yield pending.decode().split(delimiter)
+        except Exception as e:
+            failed = True
+            if isinstance(e, (RPCTimeoutError, RPCCancelledError)):
+                # The rest of the reply is still on its way; the connection cannot be reused.
+                self._close_socket()
+                self._dropped = True
+            raise
+        finally:
+            try:
+                # Drain whatever is left of an abandoned reply, or drop the connection if that fails.
+                if chunks is not None and self.socket is not None:
+                    try:
+                        for _ in chunks:
+                            pass
+                    except Exception:
+                        self._close_socket()
+            finally:
+                scope.__exit__(None, None, None)
+                self._last_activity = time.monotonic()
+                self._streaming_thread = None
+                self._lock.release()
+                # The latency includes the time the consumer spent on each record.
+                self.metrics.record(rpc_name, time.perf_counter() - start_time,
+                                    sum(len(part) for part in parts), received, error=failed)
+
+    def call_many(self, jobs, connections=4, max_in_flight=None, pool=None, limiter=None):
+        """
+        Runs a batch of RPC calls spread over several broker connections.
+
+        This client is used as one of the connections. The others are checked
+        out of pool if one is given, otherwise they are opened with this
+        client's credentials and closed again when the batch is done. A job
+        that fails does not stop the batch; its error is returned in place.
+
+        Args:
+            jobs (list): A list of (rpc_name, params) tuples, with params as for call_rpc.
+            connections (int): The number of broker connections to use.
+            max_in_flight (int, optional): The maximum number of calls outstanding at
+                                           once. Defaults to the number of connections.
+            pool (VistARPCPool, optional): A pool to take the extra connections from.
+            limiter (AdaptiveLimiter, optional): Adapts the number of calls in flight to the
+                                                 broker's latency and errors, within
+                                                 max_in_flight. Defaults to the pool's limiter
+                                                 for this broker, if it has one.
+
+        Returns:
+            list: An RPCResult for each job, in the same order as jobs.
+        """
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        if not jobs:
+            return results
+        if not self.connected:
+            error = ConnectionError("Cannot make an RPC call without a connection.")
+            return [RPCResult(rpc_name, None, error) for rpc_name, _ in jobs]
+
+        pending = queue.SimpleQueue()
+        for index, job in enumerate(jobs):
+            pending.put((index, job))
+
+        in_flight = threading.BoundedSemaphore(max_in_flight or connections)
+        if limiter is None and pool is not None:
+            limiter = pool.limiter_for(self.host, self.port)
+        sessions = [self] + self._open_batch_sessions(min(connections, len(jobs)) - 1, pool)
+
+        def work(client):
+            while True:
+                try:
+                    index, (rpc_name, params) = pending.get_nowait()
+                except queue.Empty:
+                    return True
+                try:
+                    with in_flight:
+                        if limiter is None:
+                            response = client._execute(rpc_name, params or [])
+                        else:
+                            with limiter.slot(rpc_name=rpc_name, sampled=client.sent_request):
+                                response = client._execute(rpc_name, params or [])
+                    results[index] = RPCResult(rpc_name, response.decode().strip(), None)
+                except OSError as e:
+                    # The connection itself is broken; leave the remaining jobs to the other sessions.
+                    results[index] = RPCResult(rpc_name, None, e)
+                    logging.error(f"Batch connection to {client.host}:{client.port} failed: {e}")
+                    return False
+                except Exception as e:
+                    results[index] = RPCResult(rpc_name, None, e)
+
+        healthy = {}
+
+        def run(client):
+            healthy[id(client)] = work(client)
+
+        threads = [threading.Thread(target=run, args=(client,), daemon=True) for client in sessions[1:]]
+        for thread in threads:
+            thread.start()
+        run(self)
+        for thread in threads:
+            thread.join()
+
+        for client in sessions[1:]:
+            if pool is not None:
+                pool.checkin(client, discard=not healthy.get(id(client), False))
+            else:
+                client.disconnect()
+
+        for index, (rpc_name, _) in enumerate(jobs):
+            if results[index] is None:
+                results[index] = RPCResult(rpc_name, None, ConnectionError("No healthy connection left to run the job."))
+        return results
+
+    def _open_batch_sessions(self, count, pool):
+        """Opens up to count extra sessions for call_many, skipping any that fail to open."""
+        sessions = []
+        for _ in range(count):
+            try:
+                if pool is not None:
+                    client = pool.checkout(self.host, self.port, self.access_code, self.verify_code, self.context)
+                else:
+                    client = VistARPCClient(self.host, self.port, self.access_code, self.verify_code, self.context,
+                                            cache=self.cache, metrics=self.metrics, log_bodies=self.log_bodies,
+                                            body_log_sample_rate=self.body_log_sample_rate,
+                                            auto_reconnect=self.auto_reconnect, timeout=self.timeout,
+                                            single_flight=self.single_flight,
+                                            idempotent_rpcs=self.idempotent_rpcs)
+                    client.connect()
+                    if not client.connected or not client.login() or client.create_context() is None:
+                        client.disconnect()
+                        raise ConnectionError(f"Could not open a session on {self.host}:{self.port}")
+            except Exception as e:
+                logging.warning(f"Running batch on {len(sessions) + 1} connection(s): {e}")
+                break
+            sessions.append(client)
+        return sessions
+
+    def _execute(self, rpc_name, params, timeout=None, cancel_event=None, coalesce=True):
+        """
+        Runs an RPC call through the response cache, if the client has one.
+
+        Read-only RPCs are answered from the cache when a fresh reply is held.
+        Write RPCs evict the cached replies they may have made stale.
+
+        If the client has a single-flight group, a read-only call identical to
+        one already in flight waits for that call's reply instead of being sent.
+
+        Args:
+            timeout (float, optional): Seconds the call may take. Defaults to the client's timeout.
+            cancel_event (threading.Event, optional): Setting this event abandons the call.
+            coalesce (bool): Whether the call may be coalesced. A hedge must not be,
+                             or it would wait for the very call it is meant to race.
+
+        Returns:
+            bytes: The reply data, as returned by _invoke.
+        """
+        self._check_not_streaming()
+        self._local.sent = False
+        timeout = self.timeout if timeout is None else timeout
+        flights = self.single_flight
+        if coalesce and flights is not None and flights.is_coalescable(rpc_name):
+            # A follower that ends up making the call itself only has what is left of its deadline.
+            deadline = None if timeout is None else time.monotonic() + timeout
+
+            def call():
+                remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+                return self._execute_locked(rpc_name, params, remaining, cancel_event)
+
+            # Followers wait here, before taking the lock, so calls queued on
+            # this client are coalesced too.
+            return flights.do(flights.make_key(self, rpc_name, params), call, timeout, cancel_event)
+        return self._execute_locked(rpc_name, params, timeout, cancel_event)
+
+    def sent_request(self):
+        """
+        Returns whether the calling thread's last call on this client went to the broker.
+
+        False if it was answered from the cache or by an identical call made
+        for another caller, in which case its latency says nothing about the broker.
+        """
+        return getattr(self._local, "sent", True)
+
+    def _execute_locked(self, rpc_name, params, timeout, cancel_event):
+        with self._lock, self._call_scope(timeout, cancel_event):
+            return self._execute_cached(rpc_name, params)
+
+    def _execute_cached(self, rpc_name, params):
+        cache = self.cache
+        if cache is None:
+            response = self._invoke_with_reconnect(rpc_name, params)
+        elif cache.is_cacheable(rpc_name):
+            key = cache.make_key(self, rpc_name, params)
+            response = cache.get(key)
+            if response is None:
+                response = self._invoke_with_reconnect(rpc_name, params)
+                cache.put(key, response)
+        else:
+            response = self._invoke_with_reconnect(rpc_name, params)
+            cache.invalidate_for(rpc_name)
+
+        if rpc_name == "ORWPT SELECT" and params:
+            self.selected_dfn = str(params[0][1])
+        return response
+
+    def _invoke_with_reconnect(self, rpc_name, params):
+        """
+        Calls _invoke, reconnecting and resending once if the broker had dropped the connection.
+
+        A request is resent if the connection was found closed before or while
+        it was sent. If the connection was lost after the request was sent,
+        the broker may have acted on it, so only idempotent RPCs are resent;
+        for any other RPC the error is raised and the next call reconnects.
+        """
+        with self._lock:
+            try:
+                return self._invoke(rpc_name, params)
+            except (BrokerDisconnectedError, ReplyLostError) as e:
+                if not self.auto_reconnect or self._reconnecting:
+                    raise
+                if isinstance(e, ReplyLostError) and rpc_name not in self.idempotent_rpcs:
+                    self._close_socket()
+                    self._dropped = True
+                    raise
+                logging.warning(f"Connection to {self.host}:{self.port} was dropped ({e}); reconnecting.")
+                if not self.reconnect():
+                    raise
+                return self._invoke(rpc_name, params)
+
+    def reconnect(self, attempts=5, backoff=0.5, max_backoff=30.0):
+        """
+        Replaces a broken connection: connects, logs in, creates the context
+        and reselects the patient that was selected, retrying with exponential backoff.
+
+        Args:
+            attempts (int): The maximum number of attempts.
+            backoff (float): Seconds to wait after the first failed attempt; doubled after each.
+            max_backoff (float): The longest wait between attempts, in seconds.
+
+        Returns:
+            bool: True if the session was re-established.
+        """
+        with self._lock:
+            selected_dfn = self.selected_dfn
+            self._reconnecting = True
+            try:
+                delay = backoff
+                for attempt in range(1, attempts + 1):
+                    self._close_socket()
+                    self.connect()
+                    if self.connected and self.login() and self.create_context() is not None:
+                        if selected_dfn is not None:
+                            self._invoke("ORWPT SELECT", [("literal", selected_dfn)])
+                            self.selected_dfn = selected_dfn
+                        logging.info(f"Reconnected to {self.host}:{self.port}")
+                        return True
+                    if attempt < attempts:
+                        left = self._time_left(None)
+                        if left is not None and left <= delay:
+                            logging.error(f"Giving up reconnecting to {self.host}:{self.port}: "
+                                          f"the call's deadline comes before the next attempt.")
+                            return False
+                        logging.warning(f"Reconnect attempt {attempt} to {self.host}:{self.port} failed; "
+                                        f"retrying in {delay:.1f}s")
+                        time.sleep(delay)
+                        delay = min(delay * 2, max_backoff)
+                logging.error(f"Could not reconnect to {self.host}:{self.port} after {attempts} attempts.")
+                return False
+            except Exception as e:
+                logging.error(f"An error occurred while reconnecting: {e}")
+                return False
+            finally:
+                self._reconnecting = False
+
+    def start_heartbeat(self, interval=60.0):
+        """
+        Starts a background thread that keeps the session alive.
+
+        Whenever the connection has been idle for interval seconds, the thread
+        calls the broker's "I'm here" RPC. If the connection turns out to be
+        broken, it reconnects so the next call does not have to.
+
+        Args:
+            interval (float): Seconds of inactivity before a heartbeat is sent.
+                              Should be well below the broker's idle timeout.
+        """
+        if self._heartbeat_thread is not None and self._heartbeat_thread.is_alive():
+            return
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, args=(interval,),
+                                                  name=f"vista-heartbeat-{self.host}:{self.port}", daemon=True)
+        self._heartbeat_thread.start()
+
+    def stop_heartbeat(self):
+        """Stops the heartbeat thread, if one is running."""
+        self._heartbeat_stop.set()
+        thread = self._heartbeat_thread
+        self._heartbeat_thread = None
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _heartbeat_loop(self, interval):
+        wait = interval
+        while not self._heartbeat_stop.wait(wait):
+            idle = time.monotonic() - self._last_activity
+            if idle < interval:
+                wait = interval - idle
+                continue
+            wait = interval
+            # Skip the beat if a call is in progress; that call keeps the session alive anyway.
+            if not self._lock.acquire(blocking=False):
+                continue
+            try:
+                if not self.connected:
+                    if self.auto_reconnect:
+                        self.reconnect()
+                    continue
+                with self._call_scope(self.timeout or interval, None):
+                    self._invoke(HEARTBEAT_RPC, [])
+            except Exception as e:
+                logging.warning(f"Heartbeat to {self.host}:{self.port} failed: {e}")
+                if self.auto_reconnect:
+                    self.reconnect()
+            finally:
+                self._lock.release()
+
+    def _time_left(self, timeout):
+        """Returns timeout, shortened to what is left of the current call's deadline, if there is one."""
+        if self._deadline is None:
+            return timeout
+        left = max(0.0, self._deadline - time.monotonic())
+        return left if timeout is None else min(timeout, left)
+
+    def _check_not_streaming(self):
+        """
+        Refuses a call made from inside a loop over iter_rpc_records on this client.
+
+        The socket lock is reentrant, so such a call would not wait: it would
+        send its request and read the rest of the streamed reply as its own.
+        """
+        if self._streaming_thread is threading.current_thread():
+            raise RPCStreamingError("Cannot make an RPC call on a client while iterating over one of its replies.")
+
+    @contextmanager
+    def _call_scope(self, timeout, cancel_event):
+        """
+        Applies a deadline and cancel event to the socket operations in a with block.
+
+        Scopes nest: an inner scope can only shorten the deadline of the
+        scope it runs in, e.g. when a call has to reconnect first.
+        """
+        saved = (self._deadline, self._cancel_event)
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+            self._deadline = deadline if self._deadline is None else min(deadline, self._deadline)
+        if cancel_event is not None:
+            self._cancel_event = cancel_event
+        try:
+            yield
+        finally:
+            self._deadline, self._cancel_event = saved
+
+    def _arm_socket(self):
+        """
+        Sets the socket timeout for the next blocking operation, or raises if
+        the current call is out of time or has been cancelled.
+        """
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            raise RPCCancelledError("The RPC call was cancelled.")
+        wait = None
+        if self._deadline is not None:
+            wait = self._deadline - time.monotonic()
+            if wait <= 0:
+                raise RPCTimeoutError("The RPC call did not complete before its deadline.")
+        if self._cancel_event is not None:
+            wait = CANCEL_POLL_INTERVAL if wait is None else min(wait, CANCEL_POLL_INTERVAL)
+        if self.socket.gettimeout() != wait:
+            self.socket.settimeout(wait)
+
+    def _recv_into(self, view):
+        """recv_into that honours the current call's deadline and cancel event."""
+        while True:
+            self._arm_socket()
+            try:
+                return self.socket.recv_into(view)
+            except socket.timeout:
+                # Loop so _arm_socket can tell a poll for cancellation from a missed deadline.
+                continue
+
+    def _invoke(self, rpc_name, params):
+        """
+        Sends a single RPC request and reads the complete reply.
+
+        Unlike call_rpc, errors are raised to the caller instead of logged.
+
+        Returns:
+            bytes: The reply data, without its header or the end-of-transmission marker.
+
+        Raises:
+            VistARPCError: If the broker reports a security or application error.
+        """
+        self._check_not_streaming()
+        if self.socket is not None:
+            # A call cancelled or out of time before its request goes out leaves the connection usable.
+            self._arm_socket()
+        self._local.sent = True
+        start_time = time.perf_counter()
+        parts = encode_rpc_message_parts(rpc_name, params)
+        sent = sum(len(part) for part in parts)
+        try:
+            if self.socket is None:
+                raise BrokerDisconnectedError("Not connected.")
+            if self._peer_closed():
+                raise BrokerDisconnectedError("The broker had closed the connection.")
+            try:
+                self._send_parts(parts)
+            except ConnectionError as e:
+                raise BrokerDisconnectedError(f"Sending the request failed: {e}") from e
+            response = self._read_response(rpc_reply=True)
+        except Exception as e:
+            self.metrics.record(rpc_name, time.perf_counter() - start_time, sent, error=True)
+            if isinstance(e, (RPCTimeoutError, RPCCancelledError)):
+                # The reply may still arrive later; the connection cannot be reused.
+                self._close_socket()
+                self._dropped = True
+            raise
+        finally:
+            self._last_activity = time.monotonic()
+        self.metrics.record(rpc_name, time.perf_counter() - start_time, sent, len(response))
+        return response
+
+    def _peer_closed(self):
+        """
+        Returns whether the broker has closed the connection, without blocking.
+
+        A broker that drops an idle session leaves the socket readable at
+        end of file, which a non-blocking peek sees before anything is sent.
+        """
+        self.socket.settimeout(0.0)
+        try:
+            return not self.socket.recv(1, socket.MSG_PEEK)
+        except (BlockingIOError, InterruptedError):
+            return False
+        except ConnectionError:
+            return True
+
+    def _send_parts(self, parts):
+        """
+        Sends a message given as a list of buffers.
+
+        Uses a scatter-gather sendmsg where the platform has one, so the parts
+        are never joined into an intermediate copy.
+        """
+        scatter_gather = hasattr(self.socket, 'sendmsg')
+        if not scatter_gather:
+            parts = [b''.join(parts)]
+
+        views = [memoryview(part) for part in parts if len(part)]
+        while views:
+            self._arm_socket()
+            try:
+                sent = self.socket.sendmsg(views) if scatter_gather else self.socket.send(views[0])
+            except socket.timeout:
+                continue
+            while sent:
+                if sent >= len(views[0]):
+                    sent -= len(views.pop(0))
+                else:
+                    views[0] = views[0][sent:]
+                    sent = 0
+
+    def _read_response(self, rpc_reply=False):
+        """
+        Reads one broker reply, up to the end-of-transmission marker.
+
+        Data is received straight into the connection's reusable buffer with
+        recv_into, so a reply costs no intermediate bytes objects. The buffer
+        is doubled when a reply outgrows it and replaced by one of
+        RECV_BUFFER_SIZE once the reply has been read, so one large reply does
+        not hold on to its memory for the life of the connection.
+
+        Args:
+            rpc_reply (bool): Whether the reply starts with the security and
+                              application error segments sent for RPC calls.
+
+        Returns:
+            bytes: The reply, without its header or the end-of-transmission marker.
+
+        Raises:
+            ReplyLostError: If the connection is closed before any of the reply arrives.
+            ConnectionError: If the broker closes the connection mid-reply.
+            VistARPCError: If an RPC reply carries a security or application error. The
+                           whole reply is read first, so the connection stays usable.
+        """
+        buffer = self._recv_buffer
+        length = 0
+        # Where the reply data starts, known once the header has been received.
+        start = None if rpc_reply else 0
+        error = None
+        try:
+            while True:
+                if length == len(buffer):
+                    buffer.extend(bytes(len(buffer)))
+                try:
+                    with memoryview(buffer) as view:
+                        received = self._recv_into(view[length:])
+                except ConnectionError as e:
+                    if length == 0:
+                        raise ReplyLostError(f"Connection lost before the broker replied: {e}") from e
+                    raise
+                if received == 0:
+                    if length == 0:
+                        raise ReplyLostError("Connection closed by the broker before it replied.")
+                    raise ConnectionError("Connection closed by the broker before the end of the reply.")
+                scan = length
+                length += received
+                if start is None:
+                    # Each header segment is at most a length byte and 255 bytes of text.
+                    header = parse_reply_header(buffer[:min(length, 2 * 256)])
+                    if header is None:
+                        continue
+                    start, error = header
+                    scan = start
+                end = buffer.find(ET, scan, length)
+                if end != -1:
+                    if error is not None:
+                        raise VistARPCError(error)
+                    with memoryview(buffer) as view:
+                        return bytes(view[start:end])
+        finally:
+            if len(buffer) > RECV_BUFFER_SIZE:
+                self._recv_buffer = bytearray(RECV_BUFFER_SIZE)
+
+    def _iter_response_chunks(self, rpc_reply=False):
+        """
+        Reads one broker reply, yielding each received chunk as it arrives.
+
+        Chunks are received into the connection's reusable buffer and yielded
+        as copies, so the buffer is never exported while the caller holds a chunk.
+
+        Args:
+            rpc_reply (bool): Whether the reply starts with the security and
+                              application error segments sent for RPC calls.
+                              They are read first and not yielded.
+
+        Yields:
+            bytes: The next part of the reply, without the end-of-transmission marker.
+
+        Raises:
+            ConnectionError: If the broker closes the connection mid-reply.
+            VistARPCError: If an RPC reply carries a security or application error,
+                           once the whole reply has been read.
+        """
+        buffer = self._recv_buffer
+        head = bytearray() if rpc_reply else None
+        error = None
+        while True:
+            with memoryview(buffer) as view:
+                received = self._recv_into(view)
+                if received == 0:
+                    raise ConnectionError("Connection closed by the broker before the end of the reply.")
+                start = 0
+                if head is not None:
+                    head += view[:received]
+                    header = parse_reply_header(head)
+                    if header is None:
+                        continue
+                    # Where the header ends in this chunk; earlier chunks held the rest of it.
+                    start = header[0] - (len(head) - received)
+                    error = header[1]
+                    head = None
+                end = buffer.find(ET, start, received)
+                chunk = bytes(view[start:received if end == -1 else end]) if error is None else b''
+            if chunk:
+                yield chunk
+            if end != -1:
+                if error is not None:
+                    raise VistARPCError(error)
+                return
+
     def _encode_rpc_param(self, param_type, value):
         """
         Encodes a single RPC parameter.
@@ -134,24 +1119,21 @@ class VistARPCClient:
         Returns:
             bytes: The encoded RPC parameter.
         """
-        if param_type == 'literal':
-            return b'L' + FS + str(value).encode() + GS
-        elif param_type == 'reference':
-            return b'R' + FS + str(value).encode() + GS
-        elif param_type == 'list':
-            encoded_list = b''
-            for sub, val in value:
-                encoded_list += str(sub).encode() + RS + str(val).encode() + RS
-            return b'M' + FS + encoded_list + GS
-        else:
-            raise ValueError(f"Unknown parameter type: {param_type}")
+        return encode_rpc_param(param_type, value)
 
     def disconnect(self):
         """Disconnects from the VistA server."""
+        self.stop_heartbeat()
+        self._close_socket()
+        self._dropped = False
+
+    def _close_socket(self):
+        """Closes the socket without stopping the heartbeat."""
         if self.socket:
             self.socket.close()
             self.socket = None
             self.connected = False
+            self.selected_dfn = None
             logging.info("Disconnected from the server.")
 
 if __name__ == "__main__":
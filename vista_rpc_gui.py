@@ -2,11 +2,29 @@ import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox
 import sys
 import os
+import threading
 
 # Add the directory containing the vavista package to the Python path
 sys.path.append(os.path.dirname(__file__))
 
 from vavista.rpc import connect, PLiteral, PList, PReference, PEncoded
+from vista_rpc_catalog import load_catalog
+from vista_chart_prefetch import ChartPrefetcher
+from vista_gui_tasks import BackgroundTasks
+from vista_patient_search import PatientSearchCache
+from vista_response_viewer import ResponseViewer
+
+# The most matches shown in the RPC dropdown while searching.
+RPC_SEARCH_LIMIT = 200
+
+# The patient list asks the broker for its next page once the user scrolls
+# within this many rows of the end of the patients loaded so far.
+PATIENT_PAGE_MARGIN = 20
+
+# Patient search runs as you type, once typing pauses for this many
+# milliseconds and the query has at least PATIENT_SEARCH_MIN_CHARS characters.
+PATIENT_SEARCH_DELAY = 300
+PATIENT_SEARCH_MIN_CHARS = 2
 
 important_rpcs = [
     "ORQQAL LIST",
@@ -22,6 +40,17 @@ important_rpcs = [
         "ORWPT SELECT"
     ]
 
+
+def parse_patient_list(reply):
+    """Parses DFN^Name lines, as ORWPT LIST ALL and ORQPT PROVIDER PATIENTS return them, into patient dicts."""
+    patients = []
+    for patient_info in (reply or "").split('\r\n'):
+        parts = patient_info.strip().split('^')
+        if len(parts) >= 2:
+            patients.append({"DFN": parts[0], "Name": parts[1]})
+    return patients
+
+
 class VistARPCGUI(tk.Tk):
 
     def _select_patient(self, dfn):
@@ -30,64 +59,149 @@ class VistARPCGUI(tk.Tk):
             return
 
         self._log_status(f"Selecting patient with DFN: {dfn}")
-        try:
-            reply = self.connection.invoke("ORWPT SELECT", PLiteral(dfn))
+
+        def selected(reply):
             self._log_status(f"ORWPT SELECT Raw Reply: {reply!r}")
             # Optionally, you can parse the reply to confirm selection
             self._log_status(f"Successfully selected patient with DFN: {dfn}")
-        except Exception as e:
-            self._log_status(f"Failed to select patient: {e}")
-            messagebox.showerror("RPC Error", f"Failed to select patient: {e}")
+            # Start loading the chart panels the user is likely to open next.
+            self.prefetcher.patient_selected(dfn)
+
+        self.tasks.submit(f"ORWPT SELECT {dfn}", self._invoke, "ORWPT SELECT", PLiteral(dfn),
+                          on_done=selected, on_error=lambda e: self._rpc_failed("Failed to select patient", e))
 
-    def _search_patient(self):
+    def _search_patient(self, event=None):
         if not self.connection:
             messagebox.showwarning("RPC Error", "Not connected to VistA. Please connect first.")
             return
 
         search_term = self.search_patient_entry.get()
-        if not search_term:
+        if not search_term.strip():
             messagebox.showwarning("Search Error", "Please enter a patient name to search.")
             return
 
         self._log_status(f"Searching for patient: {search_term}")
-        try:
-            # Using ORWPT LIST ALL for searching, as ENHANCED PATLOOKUP may not be available
-            patients_reply = self.connection.invoke("ORWPT LIST ALL", PLiteral(search_term), PLiteral("1"))
-            self._log_status(f"ORWPT LIST ALL Raw Reply: {patients_reply!r}")
-
-            if patients_reply and patients_reply.strip():
-                patients_list = patients_reply.split('\r\n')
-                self.patients_data = []
-                for patient_info in patients_list:
-                    if patient_info.strip():
-                        parts = patient_info.split('^')
-                        if len(parts) >= 2:
-                            dfn = parts[0]
-                            name = parts[1]
-                            self.patients_data.append({"DFN": dfn, "Name": name})
-                
-                if self.patients_data:
-                    self._open_patient_selection()
-                else:
-                    messagebox.showinfo("Search Results", "No patients found matching the search criteria.")
-            else:
-                messagebox.showinfo("Search Results", "No patients found matching the search criteria or empty response.")
+        self._run_patient_search(search_term, open_results=True)
+
+    def _schedule_patient_search(self, event=None):
+        # Wait until typing pauses, so a burst of keystrokes makes one search.
+        if self._search_after is not None:
+            self.after_cancel(self._search_after)
+        self._search_after = self.after(PATIENT_SEARCH_DELAY, self._search_as_you_type)
 
-        except Exception as e:
+    def _search_as_you_type(self):
+        self._search_after = None
+        search_term = self.search_patient_entry.get()
+        if not self.connection or len(search_term.strip()) < PATIENT_SEARCH_MIN_CHARS:
+            self.search_matches_label.config(text="")
+            return
+        self._run_patient_search(search_term, open_results=False)
+
+    def _run_patient_search(self, search_term, open_results):
+        if self._search_after is not None:
+            self.after_cancel(self._search_after)
+            self._search_after = None
+        patients = self.patient_search.lookup(search_term)
+        if patients is not None:
+            self._show_search_results(search_term, (patients, True), open_results)
+            return
+
+        # Only the newest search matters; an older one still running is abandoned.
+        if self._search_task is not None:
+            self.tasks.cancel(self._search_task)
+        # Using ORWPT LIST ALL for searching, as ENHANCED PATLOOKUP may not be available
+        self._search_task = self.tasks.submit(
+            f"ORWPT LIST ALL {search_term}", self.patient_search.search, search_term,
+            on_done=lambda result: self._show_search_results(search_term, result, open_results),
+            on_error=lambda e: self._search_failed(e, open_results))
+
+    def _fetch_patient_page(self, from_name):
+        return parse_patient_list(self._invoke("ORWPT LIST ALL", PLiteral(from_name), PLiteral("1")))
+
+    def _search_failed(self, e, open_results):
+        self._search_task = None
+        if open_results:
+            self._rpc_failed("Failed to search for patients", e)
+        else:
             self._log_status(f"Failed to search for patients: {e}")
-            messagebox.showerror("RPC Error", f"Failed to search for patients: {e}")
 
-    def __init__(self, rpc_list, rpc_info):
+    def _show_search_results(self, search_term, result, open_results):
+        self._search_task = None
+        if search_term != self.search_patient_entry.get() and not open_results:
+            return  # The user has typed on since.
+        patients, complete = result
+        self.patients_data = patients
+        # An incomplete result is the first page; the selection window fetches the rest as needed.
+        self.patients_paged = not complete
+        self.patients_prefix = self.patient_search.normalize(search_term)
+        self.search_matches_label.config(
+            text=f"{len(patients)}{'' if complete else '+'} patient(s) matching '{search_term.strip()}'")
+
+        if open_results:
+            if self.patients_data:
+                self._open_patient_selection()
+            else:
+                messagebox.showinfo("Search Results", "No patients found matching the search criteria.")
+
+    def __init__(self, rpc_list, rpc_info, catalog=None):
         super().__init__()
         self.title("VistA RPC Client")
         self.geometry("1000x700")
 
         self.rpc_list = rpc_list
         self.rpc_info = rpc_info
+        self.catalog = catalog
         self.connection = None
+        # Broker calls run in the background so the window stays responsive.
+        self.tasks = BackgroundTasks(self, on_change=self._show_in_flight)
+        # The broker connection is shared with the prefetch threads, one call at a time.
+        self.connection_lock = threading.Lock()
+        # Patient searches reuse earlier results; they are typed a letter at a time.
+        self.patient_search = PatientSearchCache(self._fetch_patient_page)
+        self._search_after = None
+        self._search_task = None
+        self.prefetcher = ChartPrefetcher(
+            lambda rpc_name, params: self._invoke(rpc_name, *[PLiteral(p) for p in params]),
+            usage_path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "prefetch_usage.json"))
 
         self._create_widgets()
 
+    def _invoke(self, rpc_name, *params):
+        with self.connection_lock:
+            return self.connection.invoke(rpc_name, *params)
+
+    def destroy(self):
+        self.tasks.shutdown()
+        self.prefetcher.close()
+        super().destroy()
+
+    def _rpc_failed(self, what, error):
+        self._log_status(f"{what}: {error}")
+        messagebox.showerror("RPC Error", f"{what}: {error}")
+
+    def _show_in_flight(self, tasks):
+        self.in_flight_list.delete(0, tk.END)
+        for task in tasks:
+            self.in_flight_list.insert(tk.END, task.label)
+        self._in_flight_ids = [task.task_id for task in tasks]
+        if tasks:
+            self.in_flight_label.config(text=f"{len(tasks)} call(s) in progress")
+            self.in_flight_bar.start(10)
+        else:
+            self.in_flight_label.config(text="Idle")
+            self.in_flight_bar.stop()
+
+    def _cancel_selected_call(self):
+        for index in self.in_flight_list.curselection():
+            if index < len(self._in_flight_ids):
+                self.tasks.cancel(self._in_flight_ids[index])
+                self._log_status("Call cancelled; its reply will be ignored.")
+
+    def _cancel_all_calls(self):
+        if self.tasks.outstanding():
+            self.tasks.cancel_all()
+            self._log_status("All calls cancelled; their replies will be ignored.")
+
     def _create_widgets(self):
         # Connection Frame
         conn_frame = ttk.LabelFrame(self, text="VistA Connection", padding="10")
@@ -135,10 +249,13 @@ class VistARPCGUI(tk.Tk):
         rpc_frame.grid(row=1, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
 
         ttk.Label(rpc_frame, text="Select RPC:").grid(row=0, column=0, padx=5, pady=2, sticky="w")
-        self.rpc_combobox = ttk.Combobox(rpc_frame, values=self.rpc_list, state="readonly")
+        # Typing into the box searches the whole catalog; the dropdown shows the matches.
+        self.rpc_combobox = ttk.Combobox(rpc_frame, values=self.rpc_list)
         self.rpc_combobox.grid(row=0, column=1, padx=5, pady=2, sticky="ew")
         self.rpc_combobox.set("ORWPT ID INFO") # Default RPC
         self.rpc_combobox.bind("<<ComboboxSelected>>", self._on_rpc_selected)
+        self.rpc_combobox.bind("<KeyRelease>", self._filter_rpcs)
+        self.rpc_combobox.bind("<Return>", self._on_rpc_selected)
 
         ttk.Label(rpc_frame, text="Parameters (comma-separated):").grid(row=1, column=0, padx=5, pady=2, sticky="w")
         self.params_entry = ttk.Entry(rpc_frame, width=50)
@@ -163,6 +280,10 @@ class VistARPCGUI(tk.Tk):
         self.search_patient_entry.grid(row=7, column=0, padx=5, pady=5, sticky="ew")
         self.search_patient_button = ttk.Button(rpc_frame, text="Search Patient", command=self._search_patient, state=tk.DISABLED)
         self.search_patient_button.grid(row=7, column=1, padx=5, pady=5, sticky="ew")
+        self.search_patient_entry.bind("<KeyRelease>", self._schedule_patient_search)
+        self.search_patient_entry.bind("<Return>", self._search_patient)
+        self.search_matches_label = ttk.Label(rpc_frame, text="")
+        self.search_matches_label.grid(row=9, column=0, columnspan=2, padx=5, pady=2, sticky="w")
 
         self.select_patient_button = ttk.Button(rpc_frame, text="Select Patient", command=self._open_patient_selection, state=tk.DISABLED)
         self.select_patient_button.grid(row=8, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
@@ -176,8 +297,10 @@ class VistARPCGUI(tk.Tk):
         display_frame.grid(row=2, column=0, columnspan=2, padx=10, pady=10, sticky="ew")
 
         ttk.Label(display_frame, text="Raw RPC Response:").grid(row=0, column=0, padx=5, pady=2, sticky="w")
-        self.raw_response_text = scrolledtext.ScrolledText(display_frame, wrap=tk.WORD, height=10)
-        self.raw_response_text.grid(row=1, column=0, columnspan=2, padx=5, pady=2, sticky="nsew")
+        # Replies can run to megabytes; the viewer only keeps a window of them in the widget.
+        self.response_viewer = ResponseViewer(display_frame, wrap=tk.WORD, height=10)
+        self.response_viewer.grid(row=1, column=0, columnspan=2, padx=5, pady=2, sticky="nsew")
+        self.raw_response_text = self.response_viewer.text
 
         ttk.Label(display_frame, text="Status Messages:").grid(row=2, column=0, padx=5, pady=2, sticky="w")
         self.status_text = scrolledtext.ScrolledText(display_frame, wrap=tk.WORD, height=5)
@@ -187,13 +310,49 @@ class VistARPCGUI(tk.Tk):
         display_frame.rowconfigure(1, weight=1)
         display_frame.rowconfigure(3, weight=1)
 
+        # Calls in progress, with buttons to cancel them
+        tasks_frame = ttk.LabelFrame(self, text="Calls in Progress", padding="10")
+        tasks_frame.grid(row=3, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="ew")
+
+        self.in_flight_label = ttk.Label(tasks_frame, text="Idle")
+        self.in_flight_label.grid(row=0, column=0, padx=5, pady=2, sticky="w")
+        self.in_flight_bar = ttk.Progressbar(tasks_frame, mode="indeterminate", length=150)
+        self.in_flight_bar.grid(row=0, column=1, padx=5, pady=2, sticky="e")
+        self.in_flight_list = tk.Listbox(tasks_frame, height=3)
+        self.in_flight_list.grid(row=1, column=0, columnspan=2, padx=5, pady=2, sticky="ew")
+        self._in_flight_ids = []
+
+        ttk.Button(tasks_frame, text="Cancel Selected", command=self._cancel_selected_call).grid(
+            row=2, column=0, padx=5, pady=2, sticky="ew")
+        ttk.Button(tasks_frame, text="Cancel All", command=self._cancel_all_calls).grid(
+            row=2, column=1, padx=5, pady=2, sticky="ew")
+        tasks_frame.columnconfigure(0, weight=1)
+        tasks_frame.columnconfigure(1, weight=1)
+
         self.columnconfigure(0, weight=1)
         self.columnconfigure(1, weight=1)
         self.rowconfigure(2, weight=1)
 
+    def _filter_rpcs(self, event=None):
+        if self.catalog is None or (event is not None and event.keysym in ("Up", "Down", "Return", "Escape", "Tab")):
+            return
+        query = self.rpc_combobox.get()
+        if query.strip():
+            self.rpc_combobox["values"] = self.catalog.search(query, limit=RPC_SEARCH_LIMIT)
+        else:
+            self.rpc_combobox["values"] = self.rpc_list
+
     def _on_rpc_selected(self, event=None):
-        selected_rpc = self.rpc_combobox.get()
-        info = self.rpc_info.get(selected_rpc, {})
+        selected_rpc = self.rpc_combobox.get().strip()
+        if self.catalog is not None:
+            matches = self.catalog.search(selected_rpc, limit=1, details=False)
+            if selected_rpc not in self.catalog and matches:
+                # Enter on a partly typed name picks the best match.
+                selected_rpc = matches[0]
+                self.rpc_combobox.set(selected_rpc)
+            info = self.rpc_info.get(selected_rpc) or self.catalog.info(selected_rpc)
+        else:
+            info = self.rpc_info.get(selected_rpc, {})
         
         description = info.get("description", "No description available.")
         parameters = info.get("parameters", "No parameters found.")
@@ -252,21 +411,33 @@ class VistARPCGUI(tk.Tk):
             messagebox.showerror("Connection Error", "All connection fields must be filled.")
             return
 
-        try:
-            self._log_status("Attempting to connect to VistA...")
-            self.connection = connect(host, int(port), access, verify, context)
-            self._log_status("Connection successful!")
-            self.invoke_button.config(state=tk.NORMAL)
-            self.get_patients_button.config(state=tk.NORMAL)
-            self.select_patient_button.config(state=tk.NORMAL)
-            self.search_patient_button.config(state=tk.NORMAL)
-            self.connect_button.config(text="Connected", state=tk.DISABLED)
-        except Exception as e:
-            self._log_status(f"Connection failed: {e}")
-            messagebox.showerror("Connection Error", f"Failed to connect: {e}")
-            self.connection = None
-            self.invoke_button.config(state=tk.DISABLED)
-            self.connect_button.config(text="Connect", state=tk.NORMAL)
+        self._log_status("Attempting to connect to VistA...")
+        self.connect_button.config(text="Connecting...", state=tk.DISABLED)
+        self.tasks.submit(f"Connect to {host}:{port}", connect, host, int(port), access, verify, context,
+                          on_done=self._connected, on_error=self._connect_failed,
+                          on_cancel=self._connect_cancelled)
+
+    def _connected(self, connection):
+        self.connection = connection
+        self.patient_search.clear()
+        self._log_status("Connection successful!")
+        self.invoke_button.config(state=tk.NORMAL)
+        self.get_patients_button.config(state=tk.NORMAL)
+        self.select_patient_button.config(state=tk.NORMAL)
+        self.search_patient_button.config(state=tk.NORMAL)
+        self.connect_button.config(text="Connected", state=tk.DISABLED)
+
+    def _connect_cancelled(self):
+        # The attempt itself keeps running; if it succeeds, the connection is dropped with its result.
+        self._log_status("Connection attempt cancelled.")
+        self.connect_button.config(text="Connect", state=tk.NORMAL)
+
+    def _connect_failed(self, e):
+        self._log_status(f"Connection failed: {e}")
+        messagebox.showerror("Connection Error", f"Failed to connect: {e}")
+        self.connection = None
+        self.invoke_button.config(state=tk.DISABLED)
+        self.connect_button.config(text="Connect", state=tk.NORMAL)
 
     def _invoke_rpc(self, event=None):
         if not self.connection:
@@ -284,31 +455,41 @@ class VistARPCGUI(tk.Tk):
         # For more complex parameter types (PList, PReference, PEncoded), 
         # the user would need to manually construct them in the input or 
         # we'd need a more sophisticated parameter input UI.
-        params = [PLiteral(p.strip()) for p in params_str.split(',') if p.strip()]
+        # The "literal:" prefix shown in the parameter hints is optional.
+        params = [PLiteral(p.strip()[len("literal:"):] if p.strip().startswith("literal:") else p.strip())
+                  for p in params_str.split(',') if p.strip()]
 
         self._log_status(f"Invoking RPC '{rpc_name}' with parameters: {params_str}")
-        self.raw_response_text.config(state=tk.NORMAL)
-        self.raw_response_text.delete(1.0, tk.END)
-
-        try:
-            # The invoke method in vavista.rpc.Connection expects *args for params
-            print(f"DEBUG: Attempting to invoke RPC: {rpc_name} with parsed params: {[p.value for p in params]}")
-            reply = self.connection.invoke(rpc_name, *params)
-            
-            if rpc_name == "ORQQAL LIST":
-                # Clean up the response for ORQQAL LIST
-                cleaned_reply = reply.replace("^", "").replace("\r\n", "").strip()
-                self.raw_response_text.insert(tk.END, cleaned_reply)
-            else:
-                self.raw_response_text.insert(tk.END, reply)
-            self.raw_response_text.config(state=tk.DISABLED)
-            self._log_status(f"RPC '{rpc_name}' invoked successfully. Response length: {len(reply) if reply else 0}")
-            print(f"DEBUG: Raw RPC reply: {reply!r}")
-        except Exception as e:
-            self.raw_response_text.insert(tk.END, f"Error: {e}")
-            self.raw_response_text.config(state=tk.DISABLED)
-            self._log_status(f"RPC '{rpc_name}' invocation failed: {e}")
-            messagebox.showerror("RPC Error", f"RPC invocation failed: {e}")
+        # The invoke method in vavista.rpc.Connection expects *args for params
+        print(f"DEBUG: Attempting to invoke RPC: {rpc_name} with parsed params: {[p.value for p in params]}")
+
+        def call():
+            reply = self.prefetcher.get(rpc_name, [p.value for p in params])
+            if reply is not None:
+                return reply, True
+            return self._invoke(rpc_name, *params), False
+
+        self.tasks.submit(f"{rpc_name} {params_str}".strip(), call,
+                          on_done=lambda result: self._show_rpc_reply(rpc_name, *result),
+                          on_error=lambda e: self._show_rpc_error(rpc_name, e))
+
+    def _show_rpc_reply(self, rpc_name, reply, prefetched):
+        if prefetched:
+            self._log_status(f"RPC '{rpc_name}' answered from the chart prefetch.")
+        if rpc_name == "ORQQAL LIST":
+            # Clean up the response for ORQQAL LIST
+            cleaned_reply = reply.replace("^", "").replace("\r\n", "").strip()
+            self.response_viewer.show(cleaned_reply)
+        else:
+            self.response_viewer.show(reply)
+        self._log_status(f"RPC '{rpc_name}' invoked successfully. Response length: {len(reply) if reply else 0}")
+        # Multi-megabyte replies would flood the console.
+        print(f"DEBUG: Raw RPC reply: {reply[:1000]!r}{'...' if reply and len(reply) > 1000 else ''}")
+
+    def _show_rpc_error(self, rpc_name, e):
+        self.response_viewer.show(f"Error: {e}")
+        self._log_status(f"RPC '{rpc_name}' invocation failed: {e}")
+        messagebox.showerror("RPC Error", f"RPC invocation failed: {e}")
 
     def _get_doctor_patients(self):
         if not self.connection:
@@ -316,69 +497,76 @@ class VistARPCGUI(tk.Tk):
             return
 
         self._log_status("Attempting to retrieve DOCTOR1's IEN...")
-        try:
-            user_info_reply = self.connection.invoke("ORWU USERINFO")
-            self._log_status(f"ORWU USERINFO Raw Reply: {user_info_reply!r}")
-            
+
+        def fetch():
+            user_info_reply = self._invoke("ORWU USERINFO")
             # Parse the user info reply to get the IEN
             # The format is typically "DUZ^Name^...^IEN"
-            user_info_parts = user_info_reply.split('^')
-            if len(user_info_parts) > 0:
-                provider_ien = user_info_parts[0] # Assuming IEN is the first part
-                self._log_status(f"Retrieved Provider IEN: {provider_ien}")
-
-                self._log_status(f"Invoking ORQPT PROVIDER PATIENTS with IEN: {provider_ien}")
-                patients_reply = self.connection.invoke("ORQPT PROVIDER PATIENTS", PLiteral(provider_ien))
-                self._log_status(f"ORQPT PROVIDER PATIENTS Raw Reply: {patients_reply!r}")
-
-                self.raw_response_text.config(state=tk.NORMAL)
-                self.raw_response_text.delete(1.0, tk.END)
-                
-                if patients_reply:
-                    patients_list = patients_reply.split('\r\n')
-                    formatted_output = "Patients for DOCTOR1 (IEN: " + provider_ien + "):\n"
-                    for patient_info in patients_list:
-                        if patient_info.strip():
-                            # Assuming format is DFN^PatientName
-                            parts = patient_info.split('^')
-                            if len(parts) >= 2:
-                                dfn = parts[0]
-                                name = parts[1]
-                                formatted_output += f"DFN: {dfn}, Name: {name}\n"
-                            else:
-                                formatted_output += f"Raw: {patient_info}\n"
-                    self.raw_response_text.insert(tk.END, formatted_output)
-                self.patients_data = []
-                for patient_info in patients_list:
-                    if patient_info.strip():
-                        parts = patient_info.split('^')
-                        if len(parts) >= 2:
-                            dfn = parts[0]
-                            name = parts[1]
-                            self.patients_data.append({"DFN": dfn, "Name": name})
-                else:
-                    self.raw_response_text.insert(tk.END, "No patients found for this provider or empty response.")
-                self.raw_response_text.config(state=tk.DISABLED)
-                self._log_status("Successfully retrieved and displayed patients.")
-
-            else:
-                self._log_status("Could not parse provider IEN from ORWU USERINFO response.")
-                messagebox.showerror("RPC Error", "Could not retrieve provider IEN.")
+            provider_ien = user_info_reply.split('^')[0] # Assuming IEN is the first part
+            if not provider_ien:
+                return user_info_reply, None, None
+            patients_reply = self._invoke("ORQPT PROVIDER PATIENTS", PLiteral(provider_ien))
+            return user_info_reply, provider_ien, patients_reply
+
+        self.tasks.submit("ORWU USERINFO, ORQPT PROVIDER PATIENTS", fetch, on_done=self._show_doctor_patients,
+                          on_error=lambda e: self._rpc_failed("Failed to get doctor's patients", e))
+
+    def _show_doctor_patients(self, replies):
+        user_info_reply, provider_ien, patients_reply = replies
+        self._log_status(f"ORWU USERINFO Raw Reply: {user_info_reply!r}")
+        if provider_ien is None:
+            self._log_status("Could not parse provider IEN from ORWU USERINFO response.")
+            messagebox.showerror("RPC Error", "Could not retrieve provider IEN.")
+            return
 
-        except Exception as e:
-            self._log_status(f"Failed to get doctor's patients: {e}")
-            messagebox.showerror("RPC Error", f"Failed to get doctor's patients: {e}")
+        self._log_status(f"Retrieved Provider IEN: {provider_ien}")
+        self._log_status(f"ORQPT PROVIDER PATIENTS Raw Reply: {patients_reply!r}")
+
+        self.patients_data = []
+        self.patients_paged = False
+        self.patients_prefix = ""
+        if patients_reply:
+            patients_list = patients_reply.split('\r\n')
+            formatted_output = "Patients for DOCTOR1 (IEN: " + provider_ien + "):\n"
+            for patient_info in patients_list:
+                if patient_info.strip():
+                    # Assuming format is DFN^PatientName
+                    parts = patient_info.split('^')
+                    if len(parts) >= 2:
+                        dfn = parts[0]
+                        name = parts[1]
+                        formatted_output += f"DFN: {dfn}, Name: {name}\n"
+                        self.patients_data.append({"DFN": dfn, "Name": name})
+                    else:
+                        formatted_output += f"Raw: {patient_info}\n"
+            self.response_viewer.show(formatted_output)
+        else:
+            self.response_viewer.show("No patients found for this provider or empty response.")
+        self._log_status("Successfully retrieved and displayed patients.")
 
     def _open_patient_selection(self):
         if not hasattr(self, 'patients_data') or not self.patients_data:
             messagebox.showwarning("Patient Selection", "Please click 'Get Doctor's Patients' first to load patient data.")
             return
         
-        PatientSelectionWindow(self, self.patients_data)
+        PatientSelectionWindow(self, self.patients_data, paged=getattr(self, 'patients_paged', False),
+                               prefix=getattr(self, 'patients_prefix', ""))
 
 
 class PatientSelectionWindow(tk.Toplevel):
-    def __init__(self, master, patients_data):
+    """
+    Lists patients for selection, however many matched.
+
+    The list is virtual: the tree only ever holds the rows that fit in the
+    window, and scrolling rewrites their values from patients_data, so the
+    window opens in the same time for ten patients or ten thousand. A paged
+    list, such as an ORWPT LIST ALL search, starts with the first page; when
+    the user scrolls near its end the next page is fetched in the background,
+    continuing from the last name loaded, until the broker has no more
+    names starting with prefix.
+    """
+
+    def __init__(self, master, patients_data, paged=False, prefix=""):
             super().__init__(master)
             self.master = master
             self.title("Select Patient")
@@ -386,102 +574,204 @@ class PatientSelectionWindow(tk.Toplevel):
             self.patients_data = patients_data
             self.selected_dfn = None
 
+            self._offset = 0            # Index of the patient in the top row
+            self._rows = 1              # Rows that fit in the tree
+            self._selected_index = None
+            self._exhausted = not paged
+            self._prefix = prefix
+            self._page_task = None
+            self._closing = False
+
             self._create_widgets()
 
     def _create_widgets(self):
-        self.tree = ttk.Treeview(self, columns=("DFN", "Name"), show="headings")
+        list_frame = ttk.Frame(self)
+        list_frame.pack(padx=10, pady=(10, 0), fill="both", expand=True)
+
+        self.tree = ttk.Treeview(list_frame, columns=("DFN", "Name"), show="headings", selectmode="browse")
         self.tree.heading("DFN", text="DFN")
         self.tree.heading("Name", text="Patient Name")
         self.tree.column("DFN", width=100)
         self.tree.column("Name", width=250)
-        self.tree.pack(padx=10, pady=10, fill="both", expand=True)
-
-        for patient in self.patients_data:
-            self.tree.insert("", "end", values=(patient["DFN"], patient["Name"]))
-
+        self.tree.pack(side="left", fill="both", expand=True)
+
+        self.scrollbar = ttk.Scrollbar(list_frame, orient="vertical", command=self._on_scrollbar)
+        self.scrollbar.pack(side="right", fill="y")
+
+        self.tree.bind("<Configure>", self._on_resize)
+        self.tree.bind("<<TreeviewSelect>>", self._on_tree_select)
+        # Wheel deltas are multiples of 120 on Windows but small numbers on macOS; only the sign is portable.
+        self.tree.bind("<MouseWheel>", lambda event: self._scroll_to(self._offset + (-3 if event.delta > 0 else 3)))
+        self.tree.bind("<Button-4>", lambda event: self._scroll_to(self._offset - 3))
+        self.tree.bind("<Button-5>", lambda event: self._scroll_to(self._offset + 3))
+        self.tree.bind("<Up>", lambda event: self._move_selection(-1))
+        self.tree.bind("<Down>", lambda event: self._move_selection(1))
+        self.tree.bind("<Prior>", lambda event: self._move_selection(-self._rows))
+        self.tree.bind("<Next>", lambda event: self._move_selection(self._rows))
         self.tree.bind("<Double-1>", self._on_double_click)
 
+        self.count_label = ttk.Label(self, text="")
+        self.count_label.pack(padx=10, anchor="w")
+
         select_button = ttk.Button(self, text="Select Patient", command=self._on_select_button_click)
         select_button.pack(pady=5)
 
-    def _on_double_click(self, event):
-        item = self.tree.selection()[0]
-        self.selected_dfn = self.tree.item(item, "values")[0]
+        self._render()
+
+    def destroy(self):
+        self._closing = True
+        if self._page_task is not None:
+            self.master.tasks.cancel(self._page_task)
+        super().destroy()
+
+    def _on_resize(self, event):
+        row_height = ttk.Style(self).lookup("Treeview", "rowheight") or 20
+        # Leave room for the heading row.
+        rows = max(1, event.height // int(row_height) - 1)
+        if rows != self._rows:
+            self._rows = rows
+            self._render()
+
+    def _render(self, fetch=True):
+        """
+        Shows the patients from _offset on in the tree's rows and updates the scrollbar.
+
+        If fetch is True and the rows shown are near the end of what is loaded,
+        the next page is requested.
+        """
+        total = len(self.patients_data)
+        self._offset = max(0, min(self._offset, total - self._rows))
+        visible = self.patients_data[self._offset:self._offset + self._rows]
+
+        items = self.tree.get_children()
+        for position, patient in enumerate(visible):
+            values = (patient["DFN"], patient["Name"])
+            if position < len(items):
+                self.tree.item(items[position], values=values)
+            else:
+                self.tree.insert("", "end", iid=str(position), values=values)
+        if len(items) > len(visible):
+            self.tree.delete(*items[len(visible):])
+
+        selected = self._selected_index
+        if selected is not None and self._offset <= selected < self._offset + len(visible):
+            self.tree.selection_set(str(selected - self._offset))
+        elif self.tree.selection():
+            self.tree.selection_set(())
+
+        if total:
+            self.scrollbar.set(self._offset / total, (self._offset + len(visible)) / total)
+        else:
+            self.scrollbar.set(0, 1)
+        if self._page_task is not None:
+            self.count_label.config(text=f"{total} patients loaded, loading more...")
+        elif self._exhausted:
+            self.count_label.config(text=f"{total} patients")
+        else:
+            self.count_label.config(text=f"{total} patients loaded so far; scroll for more")
+
+        if fetch and not self._exhausted and self._offset + self._rows >= total - PATIENT_PAGE_MARGIN:
+            self._fetch_next_page()
+
+    def _scroll_to(self, offset):
+        self._offset = offset
+        self._render()
+        return "break"
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self._scroll_to(int(float(amount) * len(self.patients_data)))
+        elif unit == "pages":
+            self._scroll_to(self._offset + int(amount) * self._rows)
+        else:
+            self._scroll_to(self._offset + int(amount))
+
+    def _on_tree_select(self, event):
+        # Rows leaving the window are deselected by _render; that is not the user clearing the selection.
+        selection = self.tree.selection()
+        if selection:
+            self._selected_index = self._offset + int(selection[0])
+
+    def _move_selection(self, step):
+        if not self.patients_data:
+            return "break"
+        if self._selected_index is None:
+            index = self._offset
+        else:
+            index = max(0, min(self._selected_index + step, len(self.patients_data) - 1))
+        self._selected_index = index
+        if index < self._offset:
+            self._offset = index
+        elif index >= self._offset + self._rows:
+            self._offset = index - self._rows + 1
+        self._render()
+        self.tree.focus(str(index - self._offset))
+        return "break"
+
+    def _fetch_next_page(self):
+        if self._page_task is not None or not self.patients_data:
+            return
+        last_name = self.patients_data[-1]["Name"]
+        self._page_task = self.master.tasks.submit(
+            f"ORWPT LIST ALL from {last_name}", self.master._invoke, "ORWPT LIST ALL",
+            PLiteral(last_name), PLiteral("1"), on_done=self._add_page, on_error=self._page_failed,
+            on_cancel=self._page_cancelled)
+
+    def _add_page(self, reply):
+        self._page_task = None
+        last_name = self.patients_data[-1]["Name"]
+        page = [patient for patient in parse_patient_list(reply) if patient["Name"] > last_name]
+        matches = [patient for patient in page if patient["Name"].upper().startswith(self._prefix)]
+        self.patients_data.extend(matches)
+        # Names come in order, so a name past the prefix means every match is loaded.
+        if len(matches) < len(page) or not page:
+            self._exhausted = True
+        self._render()
+
+    def _page_cancelled(self):
+        self._page_task = None
+        if not self._closing:
+            # Fetch again when the user next scrolls, not straight away.
+            self._render(fetch=False)
+
+    def _page_failed(self, error):
+        self._page_task = None
+        self._exhausted = True
+        self.master._log_status(f"Failed to load more patients: {error}")
+        self._render()
+
+    def _choose(self, index):
+        self.selected_dfn = self.patients_data[index]["DFN"]
         self.master.dfn_entry.delete(0, tk.END)
         self.master.dfn_entry.insert(0, self.selected_dfn)
         self.master._select_patient(self.selected_dfn)
         self.destroy()
 
+    def _on_double_click(self, event):
+        item = self.tree.identify_row(event.y)
+        if item:
+            self._choose(self._offset + int(item))
+
     def _on_select_button_click(self):
-        selected_item = self.tree.selection()
-        if not selected_item:
+        if self._selected_index is None:
             messagebox.showwarning("Selection Error", "Please select a patient from the list.")
             return
-        self.selected_dfn = self.tree.item(selected_item[0], "values")[0]
-        self.master.dfn_entry.delete(0, tk.END)
-        self.master.dfn_entry.insert(0, self.selected_dfn)
-        self.master._select_patient(self.selected_dfn)
-        self.destroy()
+        self._choose(self._selected_index)
 
 if __name__ == "__main__":
-    # Read RPC list from file
-    rpc_file_path = r"C:\Users\guest_user\Desktop\CPRS and VIsta - Copy\cprs code\cprs_rpc_list.txt"
-    all_rpc_names = []
-    try:
-        with open(rpc_file_path, 'r') as f:
-            all_rpc_names = [line.strip() for line in f if line.strip()]
-    except FileNotFoundError:
-            messagebox.showerror("File Error", f"RPC list file not found: {rpc_file_path}")
-
-    # Filter rpc_names to include only important ones
-    rpc_names = [rpc for rpc in all_rpc_names if rpc in important_rpcs]
-
-    # Parse rpc_details.txt
-    all_rpc_info = {}
-    rpc_details_file_path = r"C:\Users\guest_user\Desktop\CPRS and VIsta - Copy\cprs code\rpc_details.txt"
-    try:
-        with open(rpc_details_file_path, 'r') as f:
-            rpc_details_content = f.read()
-
-        current_category = ""
-        for line in rpc_details_content.splitlines():
-            line = line.strip()
-            if not line:
-                continue
-            if line.endswith("RPCs:"):
-                current_category = line[:-5].strip()
-                if current_category.endswith(" (None found)"):
-                    current_category = current_category[:-13]
-                continue
-            if line.startswith("*"):
-                rpc_entry = line[1:].strip()
-                if ":" in rpc_entry:
-                    rpc_name, params_str = rpc_entry.split(":", 1)
-                    rpc_name = rpc_name.strip()
-                    params_str = params_str.strip()
-                    all_rpc_info[rpc_name] = {
-                        "category": current_category,
-                        "parameters": params_str,
-                        "description": params_str # Use parameters as description for now
-                    }
-                else:
-                    rpc_name = rpc_entry.strip()
-                    all_rpc_info[rpc_name] = {
-                        "category": current_category,
-                        "parameters": "No parameters found.",
-                        "description": "No parameters found." # Use this as description if no parameters
-                    }
-    except FileNotFoundError:
-        messagebox.showwarning("File Warning", f"rpc_details.txt not found: {rpc_details_file_path}. RPC descriptions will be limited.")
-    
-    # Filter rpc_info to include only important ones and provide defaults if not found
-    rpc_info = {}
-    for rpc_name in important_rpcs:
-        rpc_info[rpc_name] = all_rpc_info.get(rpc_name, {
-            "category": "Important RPC",
-            "parameters": "No specific parameters found in rpc_details.txt.",
-            "description": "No specific description found in rpc_details.txt."
-        })
-
-    app = VistARPCGUI(rpc_names, rpc_info)
-    app.mainloop()
\ No newline at end of file
+    # The RPC list and details are parsed and indexed once, then loaded from a
+    # cache next to the list until either file changes.
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    rpc_file_path = os.path.join(base_dir, "cprs_rpc_list.txt")
+    rpc_details_file_path = os.path.join(base_dir, "rpc_details.txt")
+    catalog = load_catalog(rpc_file_path, rpc_details_file_path)
+    if not len(catalog):
+        messagebox.showerror("File Error", f"RPC list file not found: {rpc_file_path}")
+
+    # The important RPCs are listed first until the user starts typing.
+    rpc_names = [rpc for rpc in important_rpcs if rpc in catalog]
+    rpc_names += [rpc for rpc in catalog.names if rpc not in important_rpcs]
+
+    # Descriptions come from the catalog, which has placeholders for RPCs rpc_details.txt lacks.
+    app = VistARPCGUI(rpc_names, {}, catalog)
+    app.mainloop()
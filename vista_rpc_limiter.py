@@ -0,0 +1,179 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from vista_rpc_client import RPCCancelledError
+
+# Latency, in seconds, a call may always exceed the baseline by before it counts
+# as slow, so scheduling jitter on very fast calls is not read as overload.
+LATENCY_SLACK = 0.005
+
+
+class LimitReachedError(TimeoutError):
+    """
+    Raised when no slot frees up within acquire's timeout. It says nothing
+    about the connection the call would have used.
+    """
+
+
+class AdaptiveLimiter:
+    """
+    An AIMD concurrency limit for calls to one broker endpoint.
+
+    Each call takes a slot with acquire() and gives it back with release(),
+    which feeds the call's latency and outcome back into the limit:
+
+    - a call that finishes within tolerance times the baseline latency of
+      its RPC (the lowest recently seen for that RPC, since a list RPC is
+      normally far slower than a heartbeat) grows the limit additively, by
+      about increase per limit's worth of calls;
+    - a call that is slower than that, times out or loses its connection
+      shrinks the limit multiplicatively, by backoff, at most once per
+      smoothed latency so one slow burst only counts once.
+
+    Calls answered without a round trip, from a cache or by another caller's
+    coalesced call, hold a slot but are not sampled: their latency says
+    nothing about the broker.
+
+    The limit never leaves [min_limit, max_limit], max_limit being the hard
+    ceiling on parallel calls to the endpoint.
+    """
+
+    def __init__(self, max_limit=16, min_limit=1, initial_limit=4, tolerance=2.0, backoff=0.5,
+                 increase=1.0, latency_target=None):
+        """
+        Initializes the AdaptiveLimiter.
+
+        Args:
+            max_limit (int): The hard ceiling on calls in flight.
+            min_limit (int): The limit is never lowered below this.
+            initial_limit (int): The limit to start from.
+            tolerance (float): How many times the baseline latency a call may take
+                               before it counts as a sign of overload.
+            backoff (float): The factor the limit is multiplied by on overload.
+            increase (float): How much the limit grows per limit's worth of good calls.
+            latency_target (float, optional): A fixed latency, in seconds, above which
+                                              a call counts as a sign of overload,
+                                              instead of tolerance times the baseline.
+        """
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.increase = increase
+        self.latency_target = latency_target
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._baselines = {}    # RPC name -> lowest recent latency
+        self._smoothed = None   # Smoothed latency of all calls, which paces decreases
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    @property
+    def limit(self):
+        """The number of calls currently allowed in flight."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self):
+        """The number of slots currently taken."""
+        return self._in_flight
+
+    def acquire(self, timeout=None):
+        """
+        Takes a slot, waiting while the limit is reached.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a slot. Waits forever if None.
+
+        Returns:
+            float: A token to pass to release.
+
+        Raises:
+            LimitReachedError: If no slot became free within timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._in_flight >= int(self._limit):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise LimitReachedError("The broker's concurrency limit is reached.")
+                self._cond.wait(remaining)
+            self._in_flight += 1
+        return time.monotonic()
+
+    def release(self, token, overloaded=False, sample=True, rpc_name=None):
+        """
+        Gives a slot back and adjusts the limit.
+
+        Args:
+            token (float): The value acquire returned.
+            overloaded (bool): Whether the call failed in a way that suggests the
+                               broker is overloaded, e.g. it timed out.
+            sample (bool): Whether the call's latency says anything about the broker;
+                           False for calls that were cancelled or made no round trip.
+            rpc_name (str, optional): The RPC called, whose own baseline the latency is
+                                      judged against.
+        """
+        now = time.monotonic()
+        latency = now - token
+        with self._cond:
+            self._in_flight -= 1
+            if sample:
+                self._update(latency, overloaded, now, rpc_name)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, timeout=None, rpc_name=None, sampled=None):
+        """
+        Holds a slot for the duration of a with block.
+
+        Timeouts and connection errors raised by the block count as overload;
+        other errors, such as errors reported by the RPC itself, do not.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a slot, as for acquire.
+            rpc_name (str, optional): The RPC called in the block.
+            sampled (callable, optional): Called when the block ends; returns False if
+                                          the call made no round trip to the broker,
+                                          e.g. VistARPCClient.sent_request.
+        """
+        token = self.acquire(timeout)
+        try:
+            yield
+        except (TimeoutError, ConnectionError):
+            sample = sampled is None or sampled()
+            self.release(token, overloaded=sample, sample=sample, rpc_name=rpc_name)
+            raise
+        except RPCCancelledError:
+            self.release(token, sample=False)
+            raise
+        except BaseException:
+            self.release(token, sample=sampled is None or sampled(), rpc_name=rpc_name)
+            raise
+        self.release(token, sample=sampled is None or sampled(), rpc_name=rpc_name)
+
+    def _update(self, latency, overloaded, now, rpc_name=None):
+        """Applies one call's outcome to the limit. Caller holds the lock."""
+        baseline = self._baselines.get(rpc_name)
+        if baseline is None:
+            baseline = latency
+        else:
+            # The baseline follows the fastest calls down at once, and creeps up
+            # slowly in case the broker has become slower for good.
+            baseline = min(latency, baseline + (latency - baseline) * 0.01)
+        self._baselines[rpc_name] = baseline
+        if self._smoothed is None:
+            self._smoothed = latency
+        else:
+            self._smoothed += (latency - self._smoothed) * 0.2
+
+        threshold = self.latency_target
+        if threshold is None:
+            threshold = max(baseline * self.tolerance, baseline + LATENCY_SLACK)
+        if overloaded or latency > threshold:
+            if now - self._last_decrease >= self._smoothed:
+                self._limit = max(float(self.min_limit), self._limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self._limit = min(float(self.max_limit), self._limit + self.increase / self._limit)
@@ -0,0 +1,161 @@
+import json
+import threading
+from bisect import bisect_left
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class RPCMetrics:
+    """Counters and a latency histogram for one RPC name."""
+
+    __slots__ = ("calls", "errors", "latency_sum", "bucket_counts", "bytes_sent", "bytes_received")
+
+    def __init__(self, bucket_count):
+        self.calls = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+        # One count per bucket, plus a final overflow bucket for latencies above the last bound.
+        self.bucket_counts = [0] * (bucket_count + 1)
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+
+class RPCMetricsRegistry:
+    """
+    Records per-RPC call counts, error counts, latency histograms and bytes
+    sent and received.
+
+    Metrics can be read in-process with snapshot() or latency_quantile(), or
+    dumped as JSON or in the Prometheus text exposition format.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Initializes the RPCMetricsRegistry.
+
+        Args:
+            buckets (tuple): Sorted upper bounds of the latency buckets, in seconds.
+        """
+        self.buckets = tuple(buckets)
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def record(self, rpc_name, latency, bytes_sent=0, bytes_received=0, error=False):
+        """
+        Records one call.
+
+        Args:
+            rpc_name (str): The name of the RPC.
+            latency (float): The call's duration in seconds.
+            bytes_sent (int): The size of the request.
+            bytes_received (int): The size of the reply.
+            error (bool): Whether the call failed.
+        """
+        bucket = bisect_left(self.buckets, latency)
+        with self._lock:
+            metrics = self._metrics.get(rpc_name)
+            if metrics is None:
+                metrics = self._metrics[rpc_name] = RPCMetrics(len(self.buckets))
+            metrics.calls += 1
+            if error:
+                metrics.errors += 1
+            metrics.latency_sum += latency
+            metrics.bucket_counts[bucket] += 1
+            metrics.bytes_sent += bytes_sent
+            metrics.bytes_received += bytes_received
+
+    def snapshot(self, rpc_name=None):
+        """
+        Returns the metrics as plain dictionaries.
+
+        Args:
+            rpc_name (str, optional): Only return the metrics for this RPC.
+
+        Returns:
+            dict: RPC name -> metrics, or the metrics of rpc_name alone (None if never called).
+        """
+        with self._lock:
+            names = [rpc_name] if rpc_name is not None else sorted(self._metrics)
+            result = {}
+            for name in names:
+                metrics = self._metrics.get(name)
+                if metrics is None:
+                    continue
+                result[name] = {
+                    "calls": metrics.calls,
+                    "errors": metrics.errors,
+                    "latency_sum_s": metrics.latency_sum,
+                    "latency_buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], metrics.bucket_counts)),
+                    "bytes_sent": metrics.bytes_sent,
+                    "bytes_received": metrics.bytes_received,
+                }
+        if rpc_name is not None:
+            return result.get(rpc_name)
+        return result
+
+    def latency_quantile(self, rpc_name, quantile):
+        """
+        Estimates a latency quantile for an RPC from its histogram.
+
+        Returns:
+            float: The upper bound of the bucket holding the quantile, in seconds,
+                   or None if the RPC has not been called.
+        """
+        with self._lock:
+            metrics = self._metrics.get(rpc_name)
+            if metrics is None or not metrics.calls:
+                return None
+            target = quantile * metrics.calls
+            seen = 0
+            for bound, count in zip(self.buckets, metrics.bucket_counts):
+                seen += count
+                if seen >= target:
+                    return bound
+            return self.buckets[-1]
+
+    def reset(self):
+        """Forgets all recorded metrics."""
+        with self._lock:
+            self._metrics.clear()
+
+    def to_json(self):
+        """Returns all metrics as a JSON document."""
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        snapshot = self.snapshot()
+        lines = []
+
+        def family(name, kind, help_text):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+
+        def label(rpc_name):
+            return rpc_name.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        for name, field, help_text in (
+            ("vista_rpc_calls_total", "calls", "RPC calls made to the broker."),
+            ("vista_rpc_errors_total", "errors", "RPC calls that failed."),
+            ("vista_rpc_bytes_sent_total", "bytes_sent", "Request bytes sent to the broker."),
+            ("vista_rpc_bytes_received_total", "bytes_received", "Reply bytes received from the broker."),
+        ):
+            family(name, "counter", help_text)
+            for rpc_name, metrics in snapshot.items():
+                lines.append(f'{name}{{rpc="{label(rpc_name)}"}} {metrics[field]}')
+
+        family("vista_rpc_latency_seconds", "histogram", "RPC round-trip latency.")
+        for rpc_name, metrics in snapshot.items():
+            cumulative = 0
+            for bound, count in metrics["latency_buckets"].items():
+                cumulative += count
+                lines.append(f'vista_rpc_latency_seconds_bucket{{rpc="{label(rpc_name)}",le="{bound}"}} {cumulative}')
+            lines.append(f'vista_rpc_latency_seconds_sum{{rpc="{label(rpc_name)}"}} {metrics["latency_sum_s"]}')
+            lines.append(f'vista_rpc_latency_seconds_count{{rpc="{label(rpc_name)}"}} {metrics["calls"]}')
+
+        return "\n".join(lines) + "\n"
+
+
+# The registry clients record to unless they are given their own.
+default_registry = RPCMetricsRegistry()
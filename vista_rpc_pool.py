@@ -0,0 +1,359 @@
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque, namedtuple
+from contextlib import contextmanager
+
+from vista_rpc_client import DEFAULT_IDEMPOTENT_RPCS, RPCCancelledError, VistARPCClient
+from vista_rpc_limiter import AdaptiveLimiter, LimitReachedError
+from vista_rpc_metrics import default_registry
+
+# Sessions are shared between callers that log in as the same user against the
+# same broker and work in the same application context. The verify code is
+# part of the key as a salted digest, so a caller with the right access code
+# and the wrong verify code never gets another caller's logged-in session.
+PoolKey = namedtuple("PoolKey", ["host", "port", "access_code", "verify_digest", "context"])
+
+# The broker's "I'm here" keepalive RPC, cheap enough to use as a health probe.
+HEALTH_PROBE_RPC = "XWB IM HERE"
+
+# A hedge is sent when a call has been outstanding for this latency quantile of its RPC.
+HEDGE_QUANTILE = 0.95
+
+
+class VistARPCPool:
+    """A pool of connected, logged-in VistARPCClient sessions with their context already created."""
+
+    def __init__(self, max_size=4, idle_timeout=300, probe_after=30, probe_rpc=HEALTH_PROBE_RPC, cache=None,
+                 metrics=None, timeout=None, idempotent_rpcs=DEFAULT_IDEMPOTENT_RPCS, single_flight=None,
+                 max_concurrency=None):
+        """
+        Initializes the VistARPCPool.
+
+        Args:
+            max_size (int): The maximum number of open sessions per pool key, idle or checked out.
+            idle_timeout (float): Seconds an idle session is kept before it is closed.
+            probe_after (float): Sessions idle for longer than this many seconds are probed
+                                 with probe_rpc on checkout. Use 0 to probe on every checkout.
+            probe_rpc (str, optional): The RPC used as a health probe, or None to disable probing.
+            cache (RPCResponseCache, optional): A reply cache shared by the sessions the pool opens.
+                                                Its keys include the user, so users never share replies.
+            metrics (RPCMetricsRegistry, optional): Where the pool's sessions record metrics, and
+                                                    where hedging looks up latencies. Defaults to
+                                                    vista_rpc_metrics.default_registry.
+            timeout (float, optional): The default deadline, in seconds, for connecting,
+                                       health probes and calls on the pool's sessions.
+            idempotent_rpcs (set): RPCs that call_rpc may hedge, and that the pool's sessions
+                                   may resend after losing their connection mid-call.
+            single_flight (SingleFlightGroup, optional): Coalesces identical read-only calls
+                                                         made at the same time on the pool's sessions.
+            max_concurrency (int, optional): The hard ceiling on calls in flight per broker
+                                             endpoint. When set, call_rpc and call_many runs
+                                             that use the pool adapt their parallelism below
+                                             it to the broker's latency and errors, see
+                                             AdaptiveLimiter.
+        """
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.probe_after = probe_after
+        self.probe_rpc = probe_rpc
+        self.cache = cache
+        self.metrics = default_registry if metrics is None else metrics
+        self.timeout = timeout
+        self.idempotent_rpcs = frozenset(idempotent_rpcs)
+        self.single_flight = single_flight
+        self.max_concurrency = max_concurrency
+        self._limiters = {}  # (host, port) -> AdaptiveLimiter
+        self._idle = {}     # PoolKey -> deque of (client, last_used)
+        self._in_use = {}   # PoolKey -> number of checked out sessions
+        self._cond = threading.Condition()
+        self._closed = False
+        self._salt = os.urandom(16)  # Keeps verify codes out of the keys, see PoolKey
+
+    def key_for(self, client):
+        """Returns the PoolKey a client belongs to."""
+        return self._key(client.host, client.port, client.access_code, client.verify_code, client.context)
+
+    def _key(self, host, port, access_code, verify_code, context):
+        verify_digest = hmac.new(self._salt, str(verify_code).encode(), hashlib.sha256).digest()
+        return PoolKey(host, port, access_code, verify_digest, context)
+
+    def limiter_for(self, host, port):
+        """
+        Returns the adaptive concurrency limiter for a broker endpoint.
+
+        Returns:
+            AdaptiveLimiter: The endpoint's limiter, or None if max_concurrency is not set.
+        """
+        if self.max_concurrency is None:
+            return None
+        with self._cond:
+            limiter = self._limiters.get((host, port))
+            if limiter is None:
+                limiter = self._limiters[(host, port)] = AdaptiveLimiter(max_limit=self.max_concurrency)
+            return limiter
+
+    def checkout(self, host, port, access_code, verify_code, context, timeout=None):
+        """
+        Takes a ready-to-use session out of the pool, opening a new one if needed.
+
+        An idle session is only reused for the access and verify codes it was logged in with.
+
+        Args:
+            host (str): The VistA server hostname or IP address.
+            port (int): The port number for the VistA RPC Broker.
+            access_code (str): The user's access code for authentication.
+            verify_code (str): The user's verify code for authentication.
+            context (str): The application context for the RPC calls.
+            timeout (float, optional): Seconds to wait for a session when the pool
+                                       is at max_size. Waits forever if None.
+
+        Returns:
+            VistARPCClient: A logged-in client with its context created.
+
+        Raises:
+            TimeoutError: If no session became available within timeout.
+            ConnectionError: If a new session could not be opened.
+        """
+        key = self._key(host, port, access_code, verify_code, context)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            client, last_used = self._reserve(key, deadline)
+            if client is None:
+                try:
+                    return self._open(host, port, access_code, verify_code, context)
+                except Exception:
+                    self._release(key)
+                    raise
+
+            if self._is_healthy(client, last_used):
+                return client
+
+            logging.info(f"Discarding unhealthy pooled session for {host}:{port}")
+            client.disconnect()
+            self._release(key)
+
+    def checkin(self, client, discard=False):
+        """
+        Returns a session to the pool.
+
+        Args:
+            client (VistARPCClient): A client obtained from checkout.
+            discard (bool): Close the session instead of keeping it, e.g. after an
+                            error left it in an unknown state.
+        """
+        key = self.key_for(client)
+        with self._cond:
+            self._in_use[key] -= 1
+            if discard or self._closed or not client.connected:
+                client.disconnect()
+            else:
+                self._idle.setdefault(key, deque()).append((client, time.monotonic()))
+            self._evict_expired(key)
+            self._cond.notify_all()
+
+    @contextmanager
+    def session(self, host, port, access_code, verify_code, context, timeout=None):
+        """
+        Checks out a session for the duration of a with block.
+
+        The session is discarded rather than reused if the block raises.
+        """
+        client = self.checkout(host, port, access_code, verify_code, context, timeout)
+        try:
+            yield client
+        except BaseException:
+            self.checkin(client, discard=True)
+            raise
+        self.checkin(client)
+
+    def call_rpc(self, host, port, access_code, verify_code, context, rpc_name, params=None,
+                 timeout=None, hedge_after=None):
+        """
+        Makes an RPC call on a pooled session, hedging it if it is slow.
+
+        For idempotent RPCs, if no reply has arrived after hedge_after seconds a
+        duplicate is sent on a second session and the first reply wins; the
+        other call is cancelled and its session discarded. A hedge is only sent
+        if a second session is available without waiting.
+
+        Args:
+            host, port, access_code, verify_code, context: As for checkout.
+            rpc_name (str): The name of the RPC to call.
+            params (list, optional): Parameters as for VistARPCClient.call_rpc.
+            timeout (float, optional): Seconds the call may take. Defaults to the pool's timeout.
+            hedge_after (float, optional): Seconds to wait before hedging. Defaults to the
+                                           RPC's p95 latency; no hedge is sent while the
+                                           RPC has no recorded latencies.
+
+        Returns:
+            str: The response from the RPC call.
+
+        Raises:
+            Exception: The error of the first attempt if no attempt succeeded.
+        """
+        credentials = (host, port, access_code, verify_code, context)
+        params = params or []
+        timeout = self.timeout if timeout is None else timeout
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if rpc_name not in self.idempotent_rpcs:
+            hedge_after = None
+        elif hedge_after is None:
+            hedge_after = self.metrics.latency_quantile(rpc_name, HEDGE_QUANTILE)
+
+        results = queue.SimpleQueue()
+        cancel_events = []
+        limiter = self.limiter_for(host, port)
+
+        def attempt(index, cancel_event, checkout_timeout):
+            # An attempt that lost the race before it started leaves the pool's sessions alone.
+            if cancel_event.is_set():
+                results.put((index, None, RPCCancelledError("The call was answered by another attempt.")))
+                return
+            try:
+                client = self.checkout(*credentials, timeout=checkout_timeout)
+            except Exception as e:
+                results.put((index, None, e))
+                return
+            if cancel_event.is_set():
+                self.checkin(client)
+                results.put((index, None, RPCCancelledError("The call was answered by another attempt.")))
+                return
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            # A hedge is sent even when the first attempt is in a single-flight group; it must not join it.
+            coalesce = index == 0
+            try:
+                if limiter is None:
+                    response = client._execute(rpc_name, params, remaining, cancel_event, coalesce)
+                else:
+                    # A hedge is only worth sending if the broker has room for it now.
+                    with limiter.slot(remaining if index == 0 else 0, rpc_name, client.sent_request):
+                        response = client._execute(rpc_name, params, remaining, cancel_event, coalesce)
+            except Exception as e:
+                # Not getting a slot is an OSError too, but leaves the session as good as it was.
+                broken = isinstance(e, OSError) and not isinstance(e, LimitReachedError)
+                self.checkin(client, discard=broken or not client.connected)
+                results.put((index, None, e))
+                return
+            self.checkin(client)
+            results.put((index, response, None))
+
+        def launch(checkout_timeout):
+            cancel_event = threading.Event()
+            cancel_events.append(cancel_event)
+            threading.Thread(target=attempt, args=(len(cancel_events) - 1, cancel_event, checkout_timeout),
+                             daemon=True).start()
+
+        launch(timeout)
+        outstanding = 1
+        errors = {}
+        while outstanding:
+            wait = hedge_after if len(cancel_events) == 1 else None
+            try:
+                index, response, error = results.get(timeout=wait)
+            except queue.Empty:
+                logging.info(f"Hedging '{rpc_name}' after {hedge_after:.3f}s")
+                launch(0)
+                outstanding += 1
+                continue
+            outstanding -= 1
+            if error is None:
+                for cancel_event in cancel_events:
+                    cancel_event.set()
+                return response.decode().strip()
+            errors[index] = error
+        raise errors[min(errors)]
+
+    def evict_idle(self):
+        """Closes every idle session that has been unused for longer than idle_timeout."""
+        with self._cond:
+            for key in list(self._idle):
+                self._evict_expired(key)
+
+    def close(self):
+        """Closes all idle sessions. Checked out sessions are closed when checked in."""
+        with self._cond:
+            self._closed = True
+            for sessions in self._idle.values():
+                for client, _ in sessions:
+                    client.disconnect()
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def _reserve(self, key, deadline):
+        """
+        Reserves a slot for key, waiting while the key is at max_size.
+
+        Returns:
+            tuple: (client, last_used) for a reused idle session, or (None, None)
+                   when the caller should open a new one.
+        """
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise ConnectionError("The connection pool has been closed.")
+                self._evict_expired(key)
+                idle = self._idle.get(key)
+                if idle:
+                    # Reuse the most recently used session; it is the least likely to have timed out.
+                    client, last_used = idle.pop()
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return client, last_used
+                if self._in_use.get(key, 0) < self.max_size:
+                    self._in_use[key] = self._in_use.get(key, 0) + 1
+                    return None, None
+
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError(f"No pooled session available for {key.host}:{key.port}")
+                self._cond.wait(remaining)
+
+    def _release(self, key):
+        """Frees a slot reserved by _reserve whose session was never handed out."""
+        with self._cond:
+            self._in_use[key] -= 1
+            self._cond.notify_all()
+
+    def _evict_expired(self, key):
+        """Closes idle sessions for key that have outlived idle_timeout. Caller holds the lock."""
+        idle = self._idle.get(key)
+        if not idle:
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        # The deque is ordered oldest first, so expired sessions are all on the left.
+        while idle and idle[0][1] < cutoff:
+            client, _ = idle.popleft()
+            client.disconnect()
+
+    def _open(self, host, port, access_code, verify_code, context):
+        """Connects, logs in and creates the context for a new session."""
+        client = VistARPCClient(host, port, access_code, verify_code, context, cache=self.cache,
+                                metrics=self.metrics, timeout=self.timeout, single_flight=self.single_flight,
+                                idempotent_rpcs=self.idempotent_rpcs)
+        client.connect()
+        if not client.connected:
+            raise ConnectionError(f"Could not connect to {host}:{port}")
+        if not client.login():
+            raise ConnectionError(f"Login to {host}:{port} failed")
+        if client.create_context() is None:
+            client.disconnect()
+            raise ConnectionError(f"Could not create context '{context}' on {host}:{port}")
+        return client
+
+    def _is_healthy(self, client, last_used):
+        """Probes a reused session if it has been idle for longer than probe_after."""
+        if not client.connected:
+            return False
+        if self.probe_rpc is None or time.monotonic() - last_used < self.probe_after:
+            return True
+        try:
+            client._execute(self.probe_rpc, [])
+            return True
+        except Exception as e:
+            logging.warning(f"Health probe failed: {e}")
+            return False
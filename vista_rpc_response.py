@@ -0,0 +1,213 @@
+from array import array
+
+# Bytes stripped from both ends of a reply and of each line, as str.strip() would.
+_WHITESPACE = b' \t\r\n\x0b\x0c'
+
+
+class RPCRecord:
+    """
+    One line of an RPCResponse, split into delimited fields on demand.
+
+    A record holds only offsets into its response's reply bytes. The field
+    boundaries are found the first time a field is asked for, and each field
+    is decoded only when it is read.
+    """
+
+    __slots__ = ("_response", "_start", "_end", "_bounds")
+
+    def __init__(self, response, start, end):
+        self._response = response
+        self._start = start
+        self._end = end
+        self._bounds = None
+
+    def _field_bounds(self):
+        if self._bounds is None:
+            data = self._response._data
+            delimiter = self._response._delimiter
+            bounds = [self._start]
+            position = data.find(delimiter, self._start, self._end)
+            while position != -1:
+                bounds.append(position)
+                bounds.append(position + len(delimiter))
+                position = data.find(delimiter, position + len(delimiter), self._end)
+            bounds.append(self._end)
+            self._bounds = bounds
+        return self._bounds
+
+    def __len__(self):
+        return len(self._field_bounds()) // 2
+
+    def __getitem__(self, index):
+        bounds = self._field_bounds()
+        count = len(bounds) // 2
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(count))]
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("record field index out of range")
+        return self._response._decode(bounds[2 * index], bounds[2 * index + 1])
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def get(self, index, default=''):
+        """Returns field index, or default if the record has fewer fields."""
+        try:
+            return self[index]
+        except IndexError:
+            return default
+
+    def raw(self, index=None):
+        """
+        Returns a field, or the whole line if index is None, as undecoded bytes.
+        """
+        if index is None:
+            return self._response._data[self._start:self._end]
+        bounds = self._field_bounds()
+        return self._response._data[bounds[2 * index]:bounds[2 * index + 1]]
+
+    def fields(self):
+        """Returns every field decoded, like str.split(delimiter) on the line."""
+        return list(self)
+
+    def __str__(self):
+        return self._response._decode(self._start, self._end)
+
+    def __repr__(self):
+        return f"RPCRecord({str(self)!r})"
+
+
+class RPCResponse:
+    """
+    A broker reply kept as the bytes it arrived in, read as lines of delimited fields.
+
+    Line boundaries are indexed once, the first time a record is asked for;
+    field boundaries are indexed per record, and a field is decoded only when
+    it is read. Pulling one column out of a large list, such as the DFNs of
+    ORWPT LIST ALL, therefore decodes just that column and leaves the other
+    fields as bytes. The whole reply can still be had as a string with text or
+    str(), which matches what VistARPCClient.call_rpc returns.
+
+    Blank lines and surrounding whitespace are skipped, as call_rpc and
+    iter_rpc_records do.
+    """
+
+    __slots__ = ("rpc_name", "_data", "_delimiter", "_encoding", "_lines", "_text", "__weakref__")
+
+    def __init__(self, data, rpc_name=None, delimiter='^', encoding='utf-8'):
+        """
+        Initializes the RPCResponse.
+
+        Args:
+            data (bytes): The reply, without its header or end-of-transmission marker.
+            rpc_name (str, optional): The RPC the reply answers.
+            delimiter (str): The field separator within a line.
+            encoding (str): The encoding fields are decoded with.
+        """
+        self.rpc_name = rpc_name
+        self._data = bytes(data)
+        self._delimiter = delimiter.encode(encoding)
+        self._encoding = encoding
+        self._lines = None
+        self._text = None
+
+    @property
+    def data(self):
+        """The raw reply bytes."""
+        return self._data
+
+    @property
+    def text(self):
+        """The whole reply decoded and stripped, as call_rpc returns it."""
+        if self._text is None:
+            self._text = self._data.decode(self._encoding).strip()
+        return self._text
+
+    def _index_lines(self):
+        if self._lines is None:
+            data = self._data
+            # Flat (start, end) offset pairs, one pair per non-blank line.
+            lines = array('q')
+            start = 0
+            size = len(data)
+            while start < size:
+                end = data.find(b'\n', start)
+                if end == -1:
+                    end = size
+                line_start, line_end = start, end
+                while line_start < line_end and data[line_start] in _WHITESPACE:
+                    line_start += 1
+                while line_end > line_start and data[line_end - 1] in _WHITESPACE:
+                    line_end -= 1
+                if line_start < line_end:
+                    lines.append(line_start)
+                    lines.append(line_end)
+                start = end + 1
+            self._lines = lines
+        return self._lines
+
+    def _decode(self, start, end):
+        with memoryview(self._data) as view:
+            return str(view[start:end], self._encoding)
+
+    def __len__(self):
+        return len(self._index_lines()) // 2
+
+    def __bool__(self):
+        return bool(self._data.strip())
+
+    def __getitem__(self, index):
+        lines = self._index_lines()
+        count = len(lines) // 2
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(count))]
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError("response record index out of range")
+        return RPCRecord(self, lines[2 * index], lines[2 * index + 1])
+
+    def __iter__(self):
+        lines = self._index_lines()
+        for i in range(0, len(lines), 2):
+            yield RPCRecord(self, lines[i], lines[i + 1])
+
+    def column(self, index, default=''):
+        """
+        Returns one field from every record, decoding nothing else.
+
+        Args:
+            index (int): The field position, counted from 0.
+            default (str): The value for records with fewer fields.
+
+        Returns:
+            list: The field of each record, as strings.
+        """
+        data = self._data
+        delimiter = self._delimiter
+        step = len(delimiter)
+        lines = self._index_lines()
+        values = []
+        for i in range(0, len(lines), 2):
+            start, end = lines[i], lines[i + 1]
+            for _ in range(index):
+                position = data.find(delimiter, start, end)
+                if position == -1:
+                    start = -1
+                    break
+                start = position + step
+            if start == -1:
+                values.append(default)
+                continue
+            position = data.find(delimiter, start, end)
+            values.append(self._decode(start, end if position == -1 else position))
+        return values
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"RPCResponse(rpc_name={self.rpc_name!r}, bytes={len(self._data)})"
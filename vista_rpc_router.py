@@ -0,0 +1,226 @@
+import logging
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from vista_rpc_client import ReplyLostError, RPCResult, RPCTimeoutError
+from vista_rpc_pool import VistARPCPool
+
+# One broker listener.
+Endpoint = namedtuple("Endpoint", ["host", "port"])
+
+# Weight of the newest call in an endpoint's latency average.
+EWMA_ALPHA = 0.2
+
+
+class _EndpointState:
+    """Routing state of one endpoint."""
+
+    __slots__ = ("endpoint", "latency", "in_flight", "failures", "ejected_until", "calls", "errors")
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.latency = None       # EWMA of call latency in seconds, None until the first call
+        self.in_flight = 0
+        self.failures = 0         # consecutive connection failures
+        self.ejected_until = 0.0  # monotonic time the endpoint is out of rotation until
+        self.calls = 0
+        self.errors = 0
+
+
+class VistARPCRouter:
+    """
+    Spreads RPC calls over several broker listeners that serve the same VistA.
+
+    Each call goes to the healthy endpoint with the lowest expected wait: its
+    latency average (EWMA) times the calls it already has in flight plus one.
+    Endpoints nobody has called yet are tried first. An endpoint whose
+    connections fail max_failures times in a row is taken out of rotation for
+    eject_for seconds, then given another chance. Running out of pooled
+    sessions, limiter slots or time only shows that an endpoint is busy, so
+    those do not count as failures.
+
+    Calls run on sessions from a VistARPCPool, one set per endpoint. Each call
+    may land on a different session, so RPCs that depend on an earlier call on
+    the same session, such as ORWPT SELECT, should be made on a session
+    checked out of the pool instead.
+    """
+
+    def __init__(self, endpoints, access_code, verify_code, context, pool=None, max_failures=3, eject_for=30.0):
+        """
+        Initializes the VistARPCRouter.
+
+        Args:
+            endpoints (list): (host, port) pairs of the broker listeners.
+            access_code (str): The user's access code for authentication.
+            verify_code (str): The user's verify code for authentication.
+            context (str): The application context for the RPC calls.
+            pool (VistARPCPool, optional): The pool sessions are taken from. A pool
+                                           with default settings is used if None.
+            max_failures (int): Consecutive connection failures that take an endpoint out of rotation.
+            eject_for (float): Seconds an endpoint stays out of rotation.
+        """
+        if not endpoints:
+            raise ValueError("At least one endpoint is required.")
+        self.access_code = access_code
+        self.verify_code = verify_code
+        self.context = context
+        self.pool = VistARPCPool() if pool is None else pool
+        self.max_failures = max_failures
+        self.eject_for = eject_for
+        self._states = [_EndpointState(Endpoint(host, int(port))) for host, port in endpoints]
+        self._lock = threading.Lock()
+
+    def call_rpc(self, rpc_name, params=None, timeout=None):
+        """
+        Makes an RPC call on the least-loaded healthy endpoint.
+
+        If the endpoint's connection fails, or it has no session or limiter
+        slot free in time, the call is retried on the other endpoints. If the
+        call may have reached the broker, because its connection was lost
+        while waiting for the reply or it timed out, it is only retried if it
+        is idempotent (see VistARPCPool.idempotent_rpcs), since the broker may
+        already have acted on it.
+
+        Args:
+            rpc_name (str): The name of the RPC to call.
+            params (list, optional): Parameters as for VistARPCClient.call_rpc.
+            timeout (float, optional): Seconds each attempt may take. Defaults to the pool's timeout.
+
+        Returns:
+            str: The response from the RPC call.
+
+        Raises:
+            ConnectionError: If no endpoint is available.
+            Exception: The error of the last attempt.
+        """
+        tried = set()
+        error = None
+        while True:
+            state = self._pick(tried)
+            if state is None:
+                if error is not None:
+                    raise error
+                raise ConnectionError("No healthy broker endpoint is available.")
+            tried.add(state.endpoint)
+            start = time.monotonic()
+            try:
+                response = self.pool.call_rpc(state.endpoint.host, state.endpoint.port, self.access_code,
+                                              self.verify_code, self.context, rpc_name, params, timeout)
+            except (TimeoutError, ConnectionError) as e:
+                # A pool checkout or limiter timeout means the endpoint is busy, not broken.
+                self._finish(state, time.monotonic() - start, failed=isinstance(e, ConnectionError),
+                             busy=isinstance(e, TimeoutError))
+                if isinstance(e, (ReplyLostError, RPCTimeoutError)) and rpc_name not in self.pool.idempotent_rpcs:
+                    raise
+                logging.warning(f"'{rpc_name}' failed on {state.endpoint.host}:{state.endpoint.port} ({e}); "
+                                f"trying another endpoint.")
+                error = e
+                continue
+            except Exception:
+                # The broker answered, so the endpoint itself is healthy.
+                self._finish(state, time.monotonic() - start, failed=False)
+                raise
+            self._finish(state, time.monotonic() - start, failed=False)
+            return response
+
+    def call_many(self, jobs, concurrency=8):
+        """
+        Runs a batch of RPC calls spread over the endpoints.
+
+        A job that fails does not stop the batch; its error is returned in place.
+
+        Args:
+            jobs (list): A list of (rpc_name, params) tuples, with params as for call_rpc.
+            concurrency (int): The number of calls to keep in flight.
+
+        Returns:
+            list: An RPCResult for each job, in the same order as jobs.
+        """
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        pending = queue.SimpleQueue()
+        for index, job in enumerate(jobs):
+            pending.put((index, job))
+
+        def work():
+            while True:
+                try:
+                    index, (rpc_name, params) = pending.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    results[index] = RPCResult(rpc_name, self.call_rpc(rpc_name, params), None)
+                except Exception as e:
+                    results[index] = RPCResult(rpc_name, None, e)
+
+        threads = [threading.Thread(target=work, daemon=True) for _ in range(min(concurrency, len(jobs)))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def stats(self):
+        """
+        Returns the routing state of each endpoint.
+
+        Returns:
+            dict: "host:port" -> latency_ms, in_flight, calls, errors and whether it is ejected.
+        """
+        now = time.monotonic()
+        with self._lock:
+            return {
+                f"{state.endpoint.host}:{state.endpoint.port}": {
+                    "latency_ms": None if state.latency is None else state.latency * 1000,
+                    "in_flight": state.in_flight,
+                    "calls": state.calls,
+                    "errors": state.errors,
+                    "ejected": state.ejected_until > now,
+                }
+                for state in self._states
+            }
+
+    def close(self):
+        """Closes the pool's idle sessions."""
+        self.pool.close()
+
+    def _pick(self, exclude):
+        """Reserves the best endpoint not in exclude, or returns None if none is healthy."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [state for state in self._states
+                          if state.endpoint not in exclude and state.ejected_until <= now]
+            if not candidates:
+                return None
+            best = min(candidates, key=lambda state: ((state.latency or 0.0) * (state.in_flight + 1),
+                                                      state.in_flight))
+            best.in_flight += 1
+            return best
+
+    def _finish(self, state, latency, failed, busy=False):
+        """
+        Records the outcome of a call made on state's endpoint.
+
+        A call that failed for lack of a session, a limiter slot or time
+        (busy) neither counts as a failure nor says how fast the broker is.
+        """
+        with self._lock:
+            state.in_flight -= 1
+            state.calls += 1
+            if busy:
+                state.errors += 1
+                return
+            if failed:
+                state.errors += 1
+                state.failures += 1
+                if state.failures >= self.max_failures:
+                    logging.warning(f"Taking {state.endpoint.host}:{state.endpoint.port} out of rotation "
+                                    f"for {self.eject_for:.0f}s after {state.failures} failures.")
+                    state.ejected_until = time.monotonic() + self.eject_for
+                    state.failures = 0
+                return
+            state.failures = 0
+            state.latency = latency if state.latency is None else \
+                state.latency + (latency - state.latency) * EWMA_ALPHA